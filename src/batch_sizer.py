@@ -0,0 +1,124 @@
+"""Batch sizes of graph queries, optionally adapted to the observed latency."""
+
+import concurrent.futures
+import itertools
+import logging
+import re
+import threading
+import time
+
+import requests
+
+from typing import Callable, Iterable, Iterator, Sequence
+from src.settings import Settings
+
+logger = logging.getLogger(__file__)
+# (query name, ecosystem) -> BatchSizer, used when adaptive batching is enabled
+_batch_sizers = {}
+_batch_sizers_lock = threading.Lock()
+# gremlin server answers a script evaluation timeout with HTTP 500 and this message
+_SCRIPT_TIMEOUT_RE = re.compile(r'timeout|timed out|exceeded the configured', re.IGNORECASE)
+
+
+def is_timeout_error(exc: BaseException) -> bool:
+    """Check whether exc, or any exception it was raised from, is a timeout."""
+    while exc is not None:
+        if isinstance(exc, (requests.exceptions.Timeout, concurrent.futures.TimeoutError)):
+            return True
+        response = getattr(exc, 'response', None)
+        if isinstance(exc, requests.exceptions.HTTPError) and response is not None and \
+                (response.status_code in (504, 598) or response.status_code == 500 and
+                 _SCRIPT_TIMEOUT_RE.search(response.text or '')):
+            return True
+        exc = exc.__cause__
+    return False
+
+
+class BatchSizer:
+    """Batch size of a query shape, optionally adapted from observed latency.
+
+    The size grows while full batches finish well under target_latency and
+    shrinks proportionally when they take longer or time out.
+    """
+
+    def __init__(self, size: int, min_size: int = 1, max_size: int = None,
+                 target_latency: float = None, adaptive: bool = False):
+        """Create sizer starting at the given size."""
+        self._min_size = min_size
+        self._max_size = max_size or size
+        self._size = max(min_size, min(size, self._max_size))
+        self._target_latency = target_latency
+        self._adaptive = adaptive
+        self._lock = threading.Lock()
+
+    @property
+    def size(self) -> int:
+        """Return current batch size."""
+        return self._size
+
+    def batches(self, items: Sequence) -> Iterator[Sequence]:
+        """Slice items into batches of the current size."""
+        i = 0
+        while i < len(items):
+            size = self._size
+            yield items[i:i + size]
+            i += size
+
+    def observe(self, batch_size: int, elapsed: float):
+        """Adapt the size to the latency of a successful batch."""
+        if not self._adaptive:
+            return
+        with self._lock:
+            if elapsed > self._target_latency:
+                size = int(batch_size * self._target_latency / elapsed)
+                self._size = max(self._min_size, min(self._size, size))
+            elif elapsed < self._target_latency / 2 and batch_size >= self._size:
+                self._size = min(self._max_size, self._size + max(1, self._size // 4))
+
+    def timed_out(self, batch_size: int):
+        """Halve the size after a batch timed out."""
+        if not self._adaptive:
+            return
+        with self._lock:
+            self._size = max(self._min_size, min(self._size, batch_size // 2))
+
+    def run(self, fetch: Callable[[Sequence], Iterable], batch: Sequence) -> Iterable:
+        """Call fetch on batch, split it in halves and retry when it times out.
+
+        The records of split batches are chained. For fetch returning a stream
+        only the time until the stream is opened is observed.
+        """
+        time_start = time.monotonic()
+        try:
+            records = fetch(batch)
+        except Exception as e:
+            if len(batch) < 2 or not is_timeout_error(e):
+                raise
+            logger.warning('batch of %d timed out, retrying in halves', len(batch))
+            self.timed_out(len(batch))
+            half = len(batch) // 2
+            return itertools.chain(self.run(fetch, batch[:half]), self.run(fetch, batch[half:]))
+        self.observe(len(batch), time.monotonic() - time_start)
+        return records
+
+
+def get_batch_sizer(name: str, ecosystem: str, size: int) -> BatchSizer:
+    """Return batch sizer of the given query name and ecosystem.
+
+    With adaptive batching disabled, a sizer fixed at size is returned. Otherwise
+    a process wide sizer starting at size is shared by all requests.
+    """
+    settings = Settings()
+    if not settings.gremlin_adaptive_batching:
+        return BatchSizer(size)
+    key = (name, ecosystem)
+    sizer = _batch_sizers.get(key)
+    if sizer is not None:
+        return sizer
+    with _batch_sizers_lock:
+        if key not in _batch_sizers:
+            _batch_sizers[key] = BatchSizer(size, min_size=settings.gremlin_batch_min_size,
+                                            max_size=settings.gremlin_batch_max_size,
+                                            target_latency=settings.gremlin_batch_target_latency,
+                                            adaptive=True)
+        return _batch_sizers[key]
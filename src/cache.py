@@ -0,0 +1,150 @@
+"""In-process caches shared by the request handling threads of a worker."""
+
+import threading
+import time
+
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+class LRUCache:
+    """Thread-safe LRU cache with per entry TTL and an overall byte budget.
+
+    Entries expire ttl seconds after insertion. When the total size of the
+    entries, as estimated by sizeof, exceeds max_bytes, least recently used
+    entries are evicted. By default every entry counts as one.
+    """
+
+    def __init__(self, max_bytes: int, ttl: float, sizeof=lambda _: 1):
+        """Create empty cache."""
+        self._max_bytes = max_bytes
+        self._ttl = ttl
+        self._sizeof = sizeof
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
+
+    def get(self, key, default=None):
+        """Return cached value of key or default if it is missing or expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._misses += 1
+                return default
+            value, size, expires_at = entry
+            if expires_at <= time.monotonic():
+                self._remove(key)
+                self._expirations += 1
+                self._misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return value
+
+    def put(self, key, value, ttl: float = None):
+        """Store value under key, evicting least recently used entries if needed."""
+        size = self._sizeof(value)
+        if size > self._max_bytes:
+            return
+        ttl = self._ttl if ttl is None else ttl
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, size, time.monotonic() + ttl)
+            self._bytes += size
+            while self._bytes > self._max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self._evictions += 1
+
+    def pop(self, key, default=None):
+        """Remove key from the cache and return its value."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            self._remove(key)
+            return entry[0]
+
+    def clear(self):
+        """Drop all entries and reset the counters."""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self._hits = self._misses = self._evictions = self._expirations = 0
+
+    def stats(self):
+        """Return hit/miss/eviction counters along with current usage."""
+        with self._lock:
+            return {
+                'hits': self._hits,
+                'misses': self._misses,
+                'evictions': self._evictions,
+                'expirations': self._expirations,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self._max_bytes
+            }
+
+    def __len__(self):
+        """Return number of entries, including the expired ones not yet purged."""
+        return len(self._entries)
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+
+class SingleFlight:
+    """Coalesce concurrent lookups of the same key into a single fetch.
+
+    The first caller claiming a key becomes its leader and has to resolve it,
+    callers claiming it meanwhile get a future of the leader's result.
+    """
+
+    def __init__(self):
+        """Create empty registry of in-flight keys."""
+        self._flights = {}
+        self._lock = threading.Lock()
+        self._leaders = 0
+        self._coalesced = 0
+
+    def claim(self, keys):
+        """Split keys into the ones to be fetched by caller and futures of the in-flight ones."""
+        owned = []
+        waiting = {}
+        with self._lock:
+            for key in keys:
+                future = self._flights.get(key)
+                if future is None:
+                    self._flights[key] = Future()
+                    owned.append(key)
+                else:
+                    waiting[key] = future
+            self._leaders += len(owned)
+            self._coalesced += len(waiting)
+        return owned, waiting
+
+    def resolve(self, key, value=None, exception: BaseException = None):
+        """Publish result of the owned key to its waiters."""
+        with self._lock:
+            future = self._flights.pop(key, None)
+        if future is None:
+            return
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(value)
+
+    def stats(self):
+        """Return number of fetched and coalesced lookups along with in-flight keys."""
+        with self._lock:
+            return {
+                'leaders': self._leaders,
+                'coalesced': self._coalesced,
+                'in_flight': len(self._flights)
+            }
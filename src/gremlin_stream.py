@@ -0,0 +1,155 @@
+"""Incremental parsing of gremlin responses, records are yielded as they arrive."""
+
+import codecs
+import json
+import logging
+import traceback
+
+from typing import Dict, Iterable, Iterator
+from src.gremlin_transport import get_gremlin_ws_client, is_ws_connection_error, iter_gremlin_ws
+from src.settings import Settings
+from src.utils import (get_http_session, GremlinExeception, GREMLIN_SERVER_URL_REST,
+                       UPSTREAM_GREMLIN)
+
+logger = logging.getLogger(__file__)
+# '' stands for the end of buffer
+_JSON_NUMBER_TAIL = ('', '.', 'e', 'E', '+', '-', '0', '1', '2', '3', '4', '5', '6', '7', '8', '9')
+
+
+class _JsonChunkReader:
+    """Decode JSON values one by one from an iterable of byte chunks.
+
+    Only the not yet consumed tail of the input is kept in memory.
+    """
+
+    def __init__(self, chunks: Iterable[bytes]):
+        """Create reader over the given chunks."""
+        self._chunks = iter(chunks)
+        self._decoder = codecs.getincrementaldecoder('utf-8')()
+        self._json = json.JSONDecoder()
+        self._buf = ''
+        self._pos = 0
+
+    def _fill(self) -> bool:
+        """Append next chunk to the buffer, return False once input is exhausted."""
+        for chunk in self._chunks:
+            text = self._decoder.decode(chunk)
+            if text:
+                self._buf = self._buf[self._pos:] + text
+                self._pos = 0
+                return True
+        return False
+
+    def next_char(self) -> str:
+        """Consume and return next non whitespace character."""
+        while True:
+            while self._pos < len(self._buf) and self._buf[self._pos].isspace():
+                self._pos += 1
+            if self._pos < len(self._buf):
+                self._pos += 1
+                return self._buf[self._pos - 1]
+            if not self._fill():
+                raise ValueError('unexpected end of JSON input')
+
+    def expect(self, chars: str) -> str:
+        """Consume next non whitespace character which has to be one of chars."""
+        char = self.next_char()
+        if char not in chars:
+            raise ValueError('expected one of {!r} got {!r}'.format(chars, char))
+        return char
+
+    def value(self):
+        """Consume and return next complete JSON value."""
+        self.next_char()
+        self._pos -= 1
+        while True:
+            try:
+                value, end = self._json.raw_decode(self._buf, self._pos)
+            except ValueError:
+                if not self._fill():
+                    raise
+                continue
+            # a number cut by the chunk boundary, e.g. '1' of '1.5', continues in next chunk
+            if isinstance(value, (int, float)) and \
+                    self._buf[end:end + 1] in _JSON_NUMBER_TAIL and self._fill():
+                continue
+            self._pos = end
+            return value
+
+    def items(self) -> Iterator:
+        """Yield elements of the JSON array which starts at current position."""
+        self.expect('[')
+        if self.next_char() == ']':
+            return
+        self._pos -= 1
+        while True:
+            yield self.value()
+            if self.expect(',]') == ']':
+                return
+
+    def members(self) -> Iterator:
+        """Yield keys of the JSON object which starts at current position.
+
+        The consumer has to read the value of each key before the next one.
+        """
+        self.expect('{')
+        if self.next_char() == '}':
+            return
+        self._pos -= 1
+        while True:
+            key = self.value()
+            self.expect(':')
+            yield key
+            if self.expect(',}') == '}':
+                return
+
+
+def iter_gremlin_data(chunks: Iterable[bytes]) -> Iterator:
+    """Yield records of result.data of a gremlin REST response one at a time.
+
+    The response is parsed incrementally from the given byte chunks, so the
+    whole body is never held in memory.
+    """
+    reader = _JsonChunkReader(chunks)
+    for key in reader.members():
+        if key != 'result':
+            reader.value()
+            continue
+        for result_key in reader.members():
+            if result_key == 'data':
+                yield from reader.items()
+            else:
+                reader.value()
+
+
+def post_gremlin_stream(query: str, bindings: Dict = None) -> Iterator:
+    """Post the given query and bindings to gremlin, yield result records as they arrive."""
+    client = get_gremlin_ws_client()
+    payload = {
+        'gremlin': query,
+    }
+    if bindings:
+        payload['bindings'] = bindings
+    yielded = False
+    try:
+        if client is not None:
+            try:
+                # websocket responses already arrive in chunks of records
+                for record in iter_gremlin_ws(client, query, bindings):
+                    yielded = True
+                    yield record
+                return
+            except Exception as e:
+                # records can't be taken back once yielded, then REST is no option.
+                if yielded or not is_ws_connection_error(e):
+                    raise
+                logger.warning("gremlin websocket connection failed, retrying over REST",
+                               exc_info=True)
+        with get_http_session(UPSTREAM_GREMLIN).post(
+                url=GREMLIN_SERVER_URL_REST, json=payload, stream=True) as response:
+            response.raise_for_status()
+            yield from iter_gremlin_data(
+                response.iter_content(chunk_size=Settings().gremlin_stream_chunk_size))
+    except Exception as e:
+        logger.error(traceback.format_exc())
+        raise GremlinExeception from e
@@ -0,0 +1,92 @@
+"""Gremlin websocket transport, used when gremlinpython is installed and enabled."""
+
+import concurrent.futures
+import logging
+import os
+import queue
+import threading
+
+from typing import Dict, Iterator
+from src.settings import Settings
+
+try:
+    from aiohttp import ClientConnectionError, WSServerHandshakeError
+    from gremlin_python.driver.client import Client as GremlinClient
+    from gremlin_python.driver.serializer import GraphBinarySerializersV1
+    # errors of opening or losing the websocket connection
+    _WS_CONNECTION_ERRORS = (OSError, ClientConnectionError, WSServerHandshakeError)
+except ImportError:
+    GremlinClient = GraphBinarySerializersV1 = None
+    _WS_CONNECTION_ERRORS = (OSError,)
+
+logger = logging.getLogger(__file__)
+GREMLIN_SERVER_URL_WS = "ws://{host}:{port}/gremlin".format(
+    host=os.environ.get("BAYESIAN_GREMLIN_HTTP_SERVICE_HOST", "localhost"),
+    port=os.environ.get("BAYESIAN_GREMLIN_HTTP_SERVICE_PORT", "8182"))
+# gremlin websocket client, created on first use when enabled by Settings
+_gremlin_ws = {}
+_gremlin_ws_lock = threading.Lock()
+
+
+def get_gremlin_ws_client():
+    """Return process wide gremlin websocket client or None if REST is to be used.
+
+    The client keeps a pool of persistent connections using GraphBinary
+    serialization, concurrent requests are multiplexed over the pool.
+    """
+    if 'client' in _gremlin_ws:
+        return _gremlin_ws['client']
+    with _gremlin_ws_lock:
+        if 'client' not in _gremlin_ws:
+            settings = Settings()
+            client = None
+            if settings.gremlin_transport == 'websocket':
+                if GremlinClient is None:
+                    logger.warning("gremlinpython is not installed, using REST gremlin transport")
+                else:
+                    client = GremlinClient(GREMLIN_SERVER_URL_WS, 'g',
+                                           pool_size=settings.gremlin_ws_pool_size,
+                                           message_serializer=GraphBinarySerializersV1())
+            _gremlin_ws['client'] = client
+            _gremlin_ws['timeout'] = settings.gremlin_ws_timeout
+        return _gremlin_ws['client']
+
+
+def post_gremlin_ws(client, query: str, bindings: Dict = None) -> Dict:
+    """Submit query over websocket, result is shaped like the REST response."""
+    data = client.submit(query, bindings).all().result(timeout=_gremlin_ws['timeout'])
+    return {'result': {'data': data}}
+
+
+def iter_gremlin_ws(client, query: str, bindings: Dict = None) -> Iterator:
+    """Submit query over websocket, yield result records as their chunks arrive.
+
+    Each chunk has to arrive within the configured timeout of the previous one,
+    otherwise concurrent.futures.TimeoutError is raised.
+    """
+    timeout = _gremlin_ws['timeout']
+    result_set = client.submitAsync(query, bindings).result(timeout=timeout)
+    # chunks are queued on the stream before the response is done.
+    end = object()
+    result_set.done.add_done_callback(lambda _: result_set.stream.put(end))
+    while True:
+        try:
+            records = result_set.stream.get(timeout=timeout)
+        except queue.Empty:
+            raise concurrent.futures.TimeoutError(
+                'no gremlin response chunk in {} seconds'.format(timeout)) from None
+        if records is end:
+            # raises the error reported by gremlin server, if any.
+            result_set.done.result()
+            return
+        yield from records
+
+
+def is_ws_connection_error(exc: BaseException) -> bool:
+    """Check whether exc is a failure to connect to gremlin over websocket.
+
+    Such requests are retried over REST, timeouts and errors reported by
+    gremlin server are not as REST would fail the same way.
+    """
+    return (isinstance(exc, _WS_CONNECTION_ERRORS) and
+            not isinstance(exc, concurrent.futures.TimeoutError))
@@ -0,0 +1,56 @@
+"""JSON encoding of results which are encoded once and written out several times."""
+
+import json
+
+from typing import Dict
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def json_dumps_bytes(obj) -> bytes:
+    """Encode obj to compact JSON, with orjson if it is installed.
+
+    Values JSON has no type for, like UUID or datetime, are encoded as strings.
+    """
+    if orjson is not None:
+        return orjson.dumps(obj, default=str)
+    return json.dumps(obj, separators=(',', ':'), default=str).encode('utf-8')
+
+
+class EncodedJSON(dict):
+    """Result dict which is encoded to JSON once, when it is created.
+
+    The encoding is reused for the database write and the HTTP response,
+    so the dict is read-only, changing it raises TypeError.
+    """
+
+    def __init__(self, value: Dict):
+        """Copy and encode value."""
+        super().__init__(value)
+        self.encoded = json_dumps_bytes(value)
+
+    def _read_only(self, *_args, **_kwargs):
+        raise TypeError('EncodedJSON is read-only')
+
+    __setitem__ = __delitem__ = _read_only
+    clear = pop = popitem = setdefault = update = _read_only
+    __ior__ = _read_only
+
+    def __reduce__(self):
+        """Copy and pickle by value, items can't be set on the new instance."""
+        return self.__class__, (dict(self),)
+
+
+def encode_json(obj) -> bytes:
+    """Encode obj to JSON, reusing the encoding of EncodedJSON obj or values of obj."""
+    if isinstance(obj, EncodedJSON):
+        return obj.encoded
+    if not isinstance(obj, dict) or not any(isinstance(value, EncodedJSON)
+                                            for value in obj.values()):
+        return json_dumps_bytes(obj)
+    items = (json_dumps_bytes(str(key)) + b':' + encode_json(value)
+             for key, value in obj.items())
+    return b'{' + b','.join(items) + b'}'
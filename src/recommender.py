@@ -62,6 +62,7 @@ Output:
 
 """
 
+import inspect
 import json
 import datetime
 import requests
@@ -70,15 +71,30 @@ from collections import Counter, defaultdict
 import re
 import logging
 
-from src.utils import (create_package_dict, get_session_retry, select_latest_version,
+from src.utils import (create_package_dict, index_insights_packages,
+                       partition_by_package_name, LazyJSON,
+                       get_http_session, select_latest_version,
                        GREMLIN_SERVER_URL_REST, LICENSE_SCORING_URL_REST,
-                       convert_version_to_proper_semantic, get_response_data,
-                       version_info_tuple, persist_data_in_db,
-                       is_quickstart_majority, post_http_request)
+                       get_response_data, version_sort_key, persist_data_in_db,
+                       is_quickstart_majority, post_http_request, GREMLIN_QUERY_SIZE,
+                       UPSTREAM_LICENSE, UPSTREAM_INSIGHTS)
 from src.stack_aggregator import extract_user_stack_package_licenses
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__file__)
+# latest non cve and latest version of each of the packages, names are bound in batches.
+# versions are looked up through the (pecosystem, pname, version) index, one name at a time.
+_VERSION_INFORMATION_QUERY = inspect.cleandoc("""
+    data = [];
+    names.each { name ->
+        def pkg = g.V().has('ecosystem', eco).has('name', name);
+        def lnv = []; pkg.clone().values('latest_non_cve_version', 'latest_version').fill(lnv);
+        pkg.clone().as('package').V().
+        has('pecosystem', eco).has('pname', name).has('version', within(lnv)).as('version').
+        select('package', 'version').by(valueMap()).fill(data);
+    };
+    data
+    """)
 
 
 danger_word_list = [r"drop\(\)", r"V\(\)", r"count\(\)"]
@@ -97,27 +113,21 @@ class GraphDB:
 
         Also remove EPVs with CVEs and ones not present in Graph
         """
-        str_query = "data=[]; "
-        for package in input_list:
-            str_query += "pkg = g.V().has('ecosystem', '{eco}').has('name', '{pkg}'); " \
-                         "lnv = []; pkg.clone().values('latest_non_cve_version', " \
-                         "'latest_version').fill(lnv); pkg.clone().as('package').V()." \
-                         "has('pecosystem', '{eco}').has('pname', '{pkg}')." \
-                         "has('version', within(lnv)).as('version')." \
-                         "select('package', 'version').by(valueMap()).fill(data);".format(
-                                                                                    eco=ecosystem,
-                                                                                    pkg=package)
-        str_query += "data"
-        payload = {
-            'gremlin': str_query
-        }
-
-        # Query Gremlin with packages list to get their version information
-        gremlin_response = post_http_request(url=GREMLIN_SERVER_URL_REST, payload=payload)
-        if gremlin_response is None:
-            return []
-        response = get_response_data(gremlin_response, [{0: 0}])
-        return response
+        data = []
+        names = sorted(set(input_list))
+        for i in range(0, len(names), GREMLIN_QUERY_SIZE):
+            payload = {
+                'gremlin': _VERSION_INFORMATION_QUERY,
+                'bindings': {
+                    'eco': ecosystem,
+                    'names': names[i:i + GREMLIN_QUERY_SIZE]
+                }
+            }
+            # Query Gremlin with packages list to get their version information
+            gremlin_response = post_http_request(url=GREMLIN_SERVER_URL_REST, payload=payload)
+            if gremlin_response is not None:
+                data += get_response_data(gremlin_response, [])
+        return data
 
     @staticmethod
     def get_topmost_alternate(insights_result, input_stack):
@@ -203,10 +213,8 @@ class GraphDB:
             latest_version = epv.get('package').get('latest_version', [''])[0]
 
             # Convert version to a proper semantic case
-            semversion_tuple = version_info_tuple(
-                convert_version_to_proper_semantic(version, name))
-            input_stack_tuple = version_info_tuple(
-                convert_version_to_proper_semantic(input_stack.get(name, ''), name))
+            semversion_tuple = version_sort_key(version)
+            input_stack_tuple = version_sort_key(input_stack.get(name, ''))
 
             if name and version:
                 # Select highest version based on input or graph as latest version
@@ -257,31 +265,23 @@ class GraphDB:
     @staticmethod
     def get_topics_for_alt(alt_list, pgm_dict):
         """Get topics from pgm and associate with filtered versions from Graph."""
+        pgm_index = index_insights_packages(pgm_dict)
         for epv in alt_list:
             name = epv.get('package', {}).get('name', [''])[0]
-            if name:
-                for pgm_pkg_key, pgm_list in pgm_dict.items():
-                    for pgm_epv in pgm_list:
-                        if name == pgm_epv.get('package_name', ''):
-                            epv['package']['pgm_topics'] = pgm_epv.get('topic_list', [])
+            pgm_epv = pgm_index.get(name) if name else None
+            if pgm_epv is not None:
+                epv['package']['pgm_topics'] = pgm_epv.get('topic_list', [])
 
         return alt_list
 
-    @staticmethod
-    def get_topics_for_comp(comp_list, pgm_list):
-        """Get topics from pgm and associate with filtered versions from Graph."""
-        for epv in comp_list:
-            name = epv.get('package', {}).get('name', [''])[0]
-            if name:
-                for pgm_epv in pgm_list:
-                    if name == pgm_epv.get('package_name', ''):
-                        epv['package']['pgm_topics'] = pgm_epv.get('topic_list', [])
-                        epv['package']['cooccurrence_probability'] = pgm_epv.get(
-                            'cooccurrence_probability', 0)
-                        epv['package']['cooccurrence_count'] = pgm_epv.get(
-                            'cooccurrence_count', 0)
 
-        return comp_list
+def _get_license_scoring_input(epv):
+    """Create license scoring input of a graph EPV."""
+    return {
+        'package': epv.get('package', {}).get('name', [''])[0],
+        'version': epv.get('version', {}).get('version', [''])[0],
+        'licenses': epv.get('version', {}).get('declared_licenses', [])
+    }
 
 
 class License:
@@ -301,7 +301,8 @@ class License:
         json_response = {}
         try:
             # Call License service to get license data
-            lic_response = get_session_retry().post(license_url, data=json.dumps(payload))
+            lic_response = get_http_session(UPSTREAM_LICENSE).post(
+                license_url, data=json.dumps(payload))
             if lic_response.status_code != 200:
                 lic_response.raise_for_status()  # raise exception for bad http-status codes
             json_response = lic_response.json()
@@ -314,24 +315,9 @@ class License:
     @staticmethod
     def apply_license_filter(user_stack_components, epv_list_alt, epv_list_com):
         """Get License Analysis and filter out License Conflict EPVs."""
-        license_score_list_alt = license_score_list_com = []
         conflict_packages_alt = conflict_packages_com = []
-        list_pkg_names_alt = list_pkg_names_com = []
-        for epv in epv_list_alt:
-            license_scoring_input = {
-                'package': epv.get('package', {}).get('name', [''])[0],
-                'version': epv.get('version', {}).get('version', [''])[0],
-                'licenses': epv.get('version', {}).get('declared_licenses', [])
-            }
-            license_score_list_alt.append(license_scoring_input)
-
-        for epv in epv_list_com:
-            license_scoring_input = {
-                'package': epv.get('package', {}).get('name', [''])[0],
-                'version': epv.get('version', {}).get('version', [''])[0],
-                'licenses': epv.get('version', {}).get('declared_licenses', [])
-            }
-            license_score_list_com.append(license_scoring_input)
+        license_score_list_alt = [_get_license_scoring_input(epv) for epv in epv_list_alt]
+        license_score_list_com = [_get_license_scoring_input(epv) for epv in epv_list_com]
 
         # Call license scoring to find license filters
         la_output = License.invoke_license_analysis_service(user_stack_components,
@@ -345,17 +331,10 @@ class License:
             conflict_packages_com = license_filter.get('companion_packages', {}) \
                 .get('conflict_packages', [])
 
-        for epv in epv_list_alt[:]:
-            name = epv.get('package', {}).get('name', [''])[0]
-            if name in conflict_packages_alt:
-                list_pkg_names_alt.append(name)
-                epv_list_alt.remove(epv)
-
-        for epv in epv_list_com[:]:
-            name = epv.get('package', {}).get('name', [''])[0]
-            if name in conflict_packages_com:
-                list_pkg_names_com.append(name)
-                epv_list_com.remove(epv)
+        epv_list_alt, list_pkg_names_alt = partition_by_package_name(epv_list_alt,
+                                                                     conflict_packages_alt)
+        epv_list_com, list_pkg_names_com = partition_by_package_name(epv_list_com,
+                                                                     conflict_packages_com)
 
         output = {
             'filtered_alt_packages_graph': epv_list_alt,
@@ -363,7 +342,10 @@ class License:
             'filtered_comp_packages_graph': epv_list_com,
             'filtered_list_pkg_names_com': list_pkg_names_com
         }
-        logger.info("License Filter output: {}".format(json.dumps(output)))
+        logger.info("License Filter output: kept %d alternate %d companion packages, "
+                    "filtered alternate %s companion %s",
+                    len(epv_list_alt), len(epv_list_com),
+                    LazyJSON(list_pkg_names_alt), LazyJSON(list_pkg_names_com))
 
         return output
 
@@ -470,7 +452,7 @@ class RecommendationTask:
             # TODO remove hardcodedness for payloads with multiple ecosystems
 
             insights_url = RecommendationTask.get_insights_url(payload)
-            response = get_session_retry().post(insights_url, json=payload)
+            response = get_http_session(UPSTREAM_INSIGHTS).post(insights_url, json=payload)
 
             if response.status_code != 200:
                 logger.error("HTTP error {}. Error retrieving insights data.".format(
@@ -621,13 +603,11 @@ class RecommendationTask:
                         lic_filtered_alt_graph = filtered_alt_packages_graph
                         lic_filtered_comp_graph = filtered_comp_packages_graph
 
-                    # Get Topics Added to Filtered Packages
-                    topics_comp_packages_graph = GraphDB(). \
-                        get_topics_for_comp(lic_filtered_comp_graph,
-                                            insights_result.get('companion_packages', []))
-
-                    # Create Companion Block
-                    comp_packages = create_package_dict(topics_comp_packages_graph)
+                    # Create Companion Block, topics are added from the indexed insights result
+                    companion_index = index_insights_packages(
+                        insights_result.get('companion_packages', []))
+                    comp_packages = create_package_dict(lic_filtered_comp_graph,
+                                                        pgm_index=companion_index)
                     final_comp_packages = \
                         set_valid_cooccurrence_probability(comp_packages)
 
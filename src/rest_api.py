@@ -11,8 +11,9 @@ from raven.contrib.flask import Sentry
 from src.recommender import RecommendationTask as RecommendationTaskV1
 from src.stack_aggregator import StackAggregator as StackAggregatorV1
 from src.v2.recommender import RecommendationTask as RecommendationTaskV2
-from src.v2.stack_aggregator import StackAggregator as StackAggregatorV2
-from src.utils import push_data, total_time_elapsed, get_time_delta
+from src.v2.stack_aggregator import StackAggregator as StackAggregatorV2, get_epv_lookup_stats
+from src.utils import push_data, total_time_elapsed, get_time_delta, get_http_pool_stats
+from src.json_encoding import EncodedJSON, encode_json
 
 
 def setup_logging(flask_app):
@@ -50,6 +51,20 @@ def liveness():
     return flask.jsonify({}), 200
 
 
+@app.route('/api/stats')
+def stats():
+    """Handle GET requests that are sent to /api/stats REST API endpoint.
+
+    Connection pool and cache counters are kept per process, so they are
+    reported along with the pid of the worker serving the request.
+    """
+    return flask.jsonify({
+        'pid': os.getpid(),
+        'http_pools': get_http_pool_stats(),
+        'epv_lookups': get_epv_lookup_stats()
+    }), 200
+
+
 def _recommender(handler):
     r = {'recommendation': 'failure', 'external_request_id': None}
     # (fixme) Create decorator for metrics handling.
@@ -132,6 +147,9 @@ def _stack_aggregator(handler):
         except KeyError:
             pass
 
+    if isinstance(s.get('result'), EncodedJSON):
+        # v2 result is not serialized again, it is encoded once by the aggregator.
+        return flask.Response(encode_json(s), mimetype='application/json')
     return flask.jsonify(s)
 
 
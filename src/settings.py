@@ -11,3 +11,49 @@ class Settings(BaseSettings):
     snyk_package_url_format: HttpUrl = 'https://snyk.io/vuln/{ecosystem}:{package}'
     snyk_signin_url: HttpUrl = 'https://snyk.io/login'
     snyk_ecosystem_map: Dict[str, str] = {"pypi": "pip"}
+    # max number of gremlin batches in flight across the whole process
+    gremlin_batch_max_workers: int = 16
+    # max number of gremlin batches in flight for a single request
+    gremlin_batch_concurrency_per_request: int = 4
+    # keep-alive connection pool size and timeout (in seconds) per upstream
+    gremlin_http_pool_size: int = 16
+    gremlin_http_timeout: float = 120.0
+    license_http_pool_size: int = 4
+    license_http_timeout: float = 60.0
+    insights_http_pool_size: int = 4
+    insights_http_timeout: float = 60.0
+    # in-process cache of graph package/version/vuln records
+    epv_cache_max_bytes: int = 32 * 1024 * 1024
+    epv_cache_ttl: int = 3600
+    # EPVs not found in graph are not queried again until ingestion had time to finish
+    unknown_epv_cache_ttl: int = 900
+    unknown_epv_cache_max_entries: int = 100000
+    # osio user counts change slowly, cache them for long
+    osio_user_count_cache_ttl: int = 24 * 60 * 60
+    osio_user_count_cache_max_entries: int = 100000
+    # 'rest' or 'websocket', the latter needs gremlinpython and falls back to rest
+    # when it can't connect
+    gremlin_transport: str = 'rest'
+    gremlin_ws_pool_size: int = 8
+    gremlin_ws_timeout: float = 120.0
+    # parse gremlin responses incrementally instead of buffering the whole body
+    gremlin_stream_responses: bool = False
+    gremlin_stream_chunk_size: int = 64 * 1024
+    # adapt gremlin batch sizes per query and ecosystem from observed latency
+    gremlin_adaptive_batching: bool = False
+    gremlin_batch_min_size: int = 5
+    gremlin_batch_max_size: int = 500
+    gremlin_batch_target_latency: float = 5.0
+    # number of distinct version strings whose parsed form is memoized
+    version_cache_size: int = 65536
+    # answer recommended version queries from an in-process index of package versions
+    version_index_enabled: bool = False
+    version_index_ttl: int = 3600
+    version_index_max_entries: int = 100000
+    # read-only EPV snapshot served before graph, built by python -m src.v2.epv_snapshot,
+    # it is not used once older than max age and checked for a newer one every interval
+    epv_snapshot_path: str = ''
+    epv_snapshot_max_age: int = 86400
+    epv_snapshot_check_interval: float = 60.0
+    # debug: validate response models built from graph data instead of trusting it
+    validate_graph_models: bool = False
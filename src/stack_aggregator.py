@@ -7,25 +7,58 @@ Output: TBD
 
 """
 import datetime
+import inspect
 import time
 from flask import current_app
 import requests
-import copy
 from collections import defaultdict
-from src.utils import (select_latest_version, server_create_analysis, LICENSE_SCORING_URL_REST,
+from src.utils import (select_latest_version, select_max_version, server_create_analysis,
+                       LICENSE_SCORING_URL_REST,
                        post_http_request, GREMLIN_SERVER_URL_REST, persist_data_in_db,
-                       GREMLIN_QUERY_SIZE, format_date)
+                       GREMLIN_QUERY_SIZE, format_date, GremlinExeception, post_gremlin)
+from src.batch_sizer import get_batch_sizer, is_timeout_error
+from src.settings import Settings
+from src.version_index import get_version_indexes
 import logging
 
 logger = logging.getLogger(__file__)
 
+# fixed scripts, values are passed as bindings so that gremlin server
+# compiles them once and serves later requests from its script cache.
+_RECOMMENDED_VERSION_QUERY = inspect.cleandoc("""
+    g.V().has('ecosystem', eco).has('name', name).
+    out('has_version').not(out('has_cve')).values('version');
+    """)
+_EPV_DETAILS_QUERY = inspect.cleandoc("""
+    epv = [];
+    packages.each {
+        g.V().has('pecosystem', it.ecosystem).has('pname', it.name).
+        has('version', it.version).dedup().as('version').
+        in('has_version').dedup().as('package').select('version').
+        coalesce(out('has_cve').as('cve').
+                 select('package', 'version', 'cve').by(valueMap()),
+                 select('package', 'version').by(valueMap())).
+        fill(epv);
+    }
+    epv;
+    """)
+
 
 def get_recommended_version(ecosystem, name, version):
     """Fetch the recommended version in case of CVEs."""
-    query = "g.V().has('ecosystem', '{eco}').has('name', '{pkg}')" \
-            ".out('has_version').not(out('has_cve')).values('version');"\
-        .format(eco=ecosystem, pkg=name)
-    payload = {'gremlin': query}
+    if Settings().version_index_enabled:
+        try:
+            index = get_version_indexes(ecosystem, [name], 'has_cve').get(name)
+        except GremlinExeception:
+            return None
+        return index.recommended_version(version) if index else None
+    payload = {
+        'gremlin': _RECOMMENDED_VERSION_QUERY,
+        'bindings': {
+            'eco': ecosystem,
+            'name': name
+        }
+    }
     result = post_http_request(url=GREMLIN_SERVER_URL_REST, payload=payload)
     if result:
         versions = result['result']['data']
@@ -33,12 +66,7 @@ def get_recommended_version(ecosystem, name, version):
             return None
     else:
         return None
-    rec_version = version
-    for ver in versions:
-        rec_version = select_latest_version(
-            ver,
-            rec_version
-        )
+    rec_version = select_max_version([version] + versions)
     if rec_version == version:
         return None
     return rec_version
@@ -399,7 +427,11 @@ def aggregate_stack_data(stack, manifest_file, ecosystem, deps,
 
 
 def create_dependency_data_set(resolved, ecosystem):
-    """Create direct and transitive set to reduce calls to graph."""
+    """Create direct and transitive set to reduce calls to graph.
+
+    EPVs are keyed by (ecosystem, name, version). Each transitive EPV maps to
+    the set of direct EPVs pulling it in, i.e. the reverse adjacency index.
+    """
     unique_epv_dict = {
         "direct": defaultdict(set),
         "transitive": defaultdict(set)
@@ -407,11 +439,10 @@ def create_dependency_data_set(resolved, ecosystem):
 
     for pv in resolved:
         if pv.get('package') and pv.get('version'):
-            key = ecosystem + "|#|" + pv.get('package') + "|#|" + pv.get('version')
+            key = (ecosystem, pv.get('package'), pv.get('version'))
             unique_epv_dict['direct'][key] = set()
             for trans_pv in pv.get('deps', []):
-                trans_key = ecosystem + "|#|" + trans_pv.get('package') + "|#|" + \
-                            trans_pv.get('version')
+                trans_key = (ecosystem, trans_pv.get('package'), trans_pv.get('version'))
                 unique_epv_dict['transitive'][trans_key].add(key)
 
     return unique_epv_dict
@@ -420,34 +451,28 @@ def create_dependency_data_set(resolved, ecosystem):
 def remove_duplicate_cve_data(epv_list):
     """Club all CVEs for an EPV."""
     graph_dict = {}
-    result = []
     for data in epv_list['result']['data']:
-        pv = data.get('version').get('pname')[0] + ":" + \
-             data.get('version').get('version')[0]
-        if pv not in graph_dict:
-            graph_dict[pv] = {}
-        graph_dict[pv].update(data)
-        if 'cves' not in graph_dict[pv]:
-            graph_dict[pv]['cves'] = list()
-        if 'cve' in data:
-            cve = graph_dict[pv].pop('cve')
-            # Fixes Issue
-            # https://github.com/fabric8-analytics/fabric8-analytics-vscode-extension/issues/328
-            if cve not in graph_dict[pv]['cves']:
-                graph_dict[pv]['cves'].append(cve)
+        pv = (data.get('version').get('pname')[0], data.get('version').get('version')[0])
+        merged = graph_dict.get(pv)
+        if merged is None:
+            merged = graph_dict[pv] = {'cves': []}
+        for key, value in data.items():
+            if key != 'cve':
+                merged[key] = value
+        # Fixes Issue
+        # https://github.com/fabric8-analytics/fabric8-analytics-vscode-extension/issues/328
+        if 'cve' in data and data['cve'] not in merged['cves']:
+            merged['cves'].append(data['cve'])
 
     # create a uniform structure for direct and transitive
-    for x, y in graph_dict.items():
-        z = list()
-        z.append(y)
-        data = {'data': z}
-        result.append(data)
-
-    return result
+    return [{'data': [merged]} for merged in graph_dict.values()]
 
 
 def add_transitive_details(epv_list, epv_set):
-    """Add transitive dict which affects direct dependencies."""
+    """Add transitive dict which affects direct dependencies.
+
+    Graph records are shared, not copied, they are only read afterwards.
+    """
     direct = epv_set['direct']
     transitive = epv_set['transitive']
     result = []
@@ -456,89 +481,83 @@ def add_transitive_details(epv_list, epv_set):
     # Add transitive dict as necessary
     for data in cve_epv_list:
         epv = data['data'][0]
-        epv_str = epv['version']['pecosystem'][0] + "|#|" + \
-            epv['version']['pname'][0] + "|#|" + \
-            epv['version']['version'][0]
-
-        if epv_str in direct:
-            result.append(copy.deepcopy(data))
-        if epv_str in transitive:
-            affected_deps = transitive[epv_str]
+        key = (epv['version']['pecosystem'][0],
+               epv['version']['pname'][0],
+               epv['version']['version'][0])
+
+        if key in direct:
+            result.append(data)
+        if key in transitive:
             trans_dict = {
                 'isTransitive': True,
-                'affected_direct_deps': []
+                'affected_direct_deps': [{"package": name, "version": version}
+                                         for _, name, version in transitive[key]
+                                         if name and version]
             }
-            for dep in affected_deps:
-                eco, name, version = dep.split("|#|")
-                if name and version:
-                    trans_dict['affected_direct_deps'].append(
-                        {
-                            "package": name,
-                            "version": version
-                        }
-                    )
-            epv['transitive'] = trans_dict
-            result.append(copy.deepcopy(data))
+            # the direct entry of the same EPV must not get the transitive block
+            result.append({'data': [dict(epv, transitive=trans_dict)]})
 
     return result
 
 
+def get_epv_details(epvs):
+    """Get package, version and cve details of the given (ecosystem, name, version) from graph."""
+    def fetch(batch):
+        packages = [{'ecosystem': eco, 'name': name, 'version': ver}
+                    for eco, name, ver in batch]
+        # call_gremlin in batch
+        time_start = time.time()
+        try:
+            result = post_gremlin(_EPV_DETAILS_QUERY, {'packages': packages})
+        except GremlinExeception as e:
+            # timed out batches are split by the sizer, other failures leave the batch out
+            if len(batch) > 1 and is_timeout_error(e):
+                raise
+            return []
+        logger.info('elapsed_time for gremlin call: {}'.format(time.time() - time_start))
+        return result['result']['data']
+
+    data = []
+    ecosystem = epvs[0][0] if epvs else ''
+    sizer = get_batch_sizer('v1_epv_details', ecosystem, GREMLIN_QUERY_SIZE)
+    for batch in sizer.batches(epvs):
+        data += sizer.run(fetch, batch)
+    return data
+
+
 def get_tr_dependency_data(epv_set):
     """Get transitive dependency data from graph."""
-    query = "epv=[];"
+    epvs = list(epv_set['transitive'])
+    tr_list = [(name, ver) for _, name, ver in epvs]
     tr_epv_list = {
         "result": {
-            "data": []
+            "data": get_epv_details(epvs)
         }
     }
-    batch_query = "a = g.V().has('pecosystem', '{eco}').has('pname', '{name}')." \
-                  "has('version', '{ver}').dedup(); a.clone().as('version')." \
-                  "in('has_version').dedup().as('package').select('version')." \
-                  "coalesce(out('has_cve').as('cve')." \
-                  "select('package','version','cve').by(valueMap())," \
-                  "select('package','version').by(valueMap()))." \
-                  "fill(epv);"
-    i = 1
-    epvs = [x for x, y in epv_set['transitive'].items()]
-    tr_list = []
-    for epv in epvs:
-        eco, name, ver = epv.split('|#|')
-        tr_list.append((name, ver))
-        query += batch_query.format(eco=eco, name=name, ver=ver)
-        if i >= GREMLIN_QUERY_SIZE:
-            i = 1
-            # call_gremlin in batch
-            payload = {'gremlin': query}
-            result = post_http_request(url=GREMLIN_SERVER_URL_REST, payload=payload)
-            if result:
-                tr_epv_list['result']['data'] += result['result']['data']
-            query = "epv=[];"
-        i += 1
-
-    if i > 1:
-        payload = {'gremlin': query}
-        time_start = time.time()
-        result = post_http_request(url=GREMLIN_SERVER_URL_REST, payload=payload)
-        logger.info('elapsed_time for gremlin call: {}'.format(time.time() - time_start))
-        if result:
-            tr_epv_list['result']['data'] += result['result']['data']
     return tr_epv_list, tr_list
 
 
+def index_epv_data(epv_data):
+    """Index graph records by (pname, version), first record of each EPV wins."""
+    index = {}
+    for knowndep in epv_data:
+        version_node = knowndep['version']
+        index.setdefault((version_node['pname'][0], version_node['version'][0]), knowndep)
+    return index
+
+
 def find_unknown_deps(epv_data, epv_list, dep_list, unknown_deps_list, is_transitive=False):
     """Find the list of unknown dependencies."""
+    epv_index = index_epv_data(epv_data)
     for pkg, ver in dep_list:
-        known_flag = False
-        for knowndep in epv_data:
+        knowndep = epv_index.get((pkg, ver))
+        if knowndep is not None:
             version_node = knowndep['version']
-            if pkg == knowndep['version']['pname'][0] and ver == knowndep['version']['version'][0]:
-                if is_transitive and 'cve' in knowndep:
-                    epv_list['result']['data'].append(knowndep)
-                if version_node.get('licenses') or version_node.get('declared_licenses'):
-                    known_flag = True
-                break
-        if not known_flag:
-            unknown_deps_list.append({'name': pkg, 'version': ver})
+            if is_transitive and 'cve' in knowndep:
+                epv_list['result']['data'].append(knowndep)
+            if version_node.get('licenses') or version_node.get('declared_licenses'):
+                continue
+        unknown_deps_list.append({'name': pkg, 'version': ver})
     return epv_list, unknown_deps_list
 
 
@@ -551,36 +570,9 @@ def get_dependency_data(epv_set):
         }
     }
     unknown_deps_list = []
-    query = "epv=[];"
-    batch_query = "a = g.V().has('pecosystem', '{eco}').has('pname', '{name}')." \
-                  "has('version', '{ver}').dedup(); a.clone().as('version')." \
-                  "in('has_version').dedup().as('package').select('version')." \
-                  "coalesce(out('has_cve').as('cve')." \
-                  "select('package','version','cve').by(valueMap())," \
-                  "select('package','version').by(valueMap()))." \
-                  "fill(epv);"
-    i = 1
-    epvs = [x for x, y in epv_set['direct'].items()]
-    dep_list = []
-    for epv in epvs:
-        eco, name, ver = epv.split('|#|')
-        dep_list.append((name, ver))
-        query += batch_query.format(eco=eco, name=name, ver=ver)
-        if i >= GREMLIN_QUERY_SIZE:
-            i = 1
-            # call_gremlin in batch
-            payload = {'gremlin': query}
-            result = post_http_request(url=GREMLIN_SERVER_URL_REST, payload=payload)
-            if result:
-                epv_list['result']['data'] += result['result']['data']
-            query = "epv=[];"
-        i += 1
-
-    if i > 1:
-        payload = {'gremlin': query}
-        result = post_http_request(url=GREMLIN_SERVER_URL_REST, payload=payload)
-        if result:
-            epv_list['result']['data'] += result['result']['data']
+    epvs = list(epv_set['direct'])
+    dep_list = [(name, ver) for _, name, ver in epvs]
+    epv_list['result']['data'] += get_epv_details(epvs)
 
     tr_epv_list, tr_list = get_tr_dependency_data(epv_set)
     transitive_count = len(tr_epv_list['result']['data'])
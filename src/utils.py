@@ -1,8 +1,11 @@
 """Various utility functions used across the repo."""
 
 import datetime
+import functools
+import json
 import logging
 import os
+import threading
 import time
 import traceback
 
@@ -18,10 +21,15 @@ from requests.adapters import HTTPAdapter
 from requests.packages.urllib3.util.retry import Retry
 from requests_futures.sessions import FuturesSession
 from selinon import run_flow
-from sqlalchemy import create_engine
+from sqlalchemy import String, cast, create_engine, literal
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.orm import sessionmaker
+from src.cache import LRUCache
+from src.settings import Settings
+from src.gremlin_transport import get_gremlin_ws_client, is_ws_connection_error, post_gremlin_ws
+from src.json_encoding import EncodedJSON
 
 
 class DatabaseException(Exception):
@@ -46,6 +54,7 @@ LICENSE_SCORING_URL_REST = "http://{host}:{port}".format(
     port=os.environ.get("LICENSE_SERVICE_PORT", "6162"))
 
 zero_version = sv.Version("0.0.0")
+_zero_version_key = (0, 0, 0, ())
 # Create Postgres Connection Session
 quickstart_tuple = ("org.wildfly.swarm",
                     "org.springframework.boot",
@@ -55,6 +64,16 @@ worker_count = int(os.getenv('FUTURES_SESSION_WORKER_COUNT', '100'))
 _session = FuturesSession(max_workers=worker_count)
 GREMLIN_QUERY_SIZE = int(os.environ.get("GREMLIN_QUERY_SIZE", 50))
 
+# upstream services which get their own keep-alive connection pool
+UPSTREAM_GREMLIN = 'gremlin'
+UPSTREAM_LICENSE = 'license'
+UPSTREAM_INSIGHTS = 'insights'
+_http_sessions = {}
+_http_sessions_lock = threading.Lock()
+# (ecosystem, name, version) -> osio user count, sized by entry count.
+_osio_user_count_cache = LRUCache(max_bytes=Settings().osio_user_count_cache_max_entries,
+                                  ttl=Settings().osio_user_count_cache_ttl)
+
 METRICS_COLLECTION_URL = "http://{base_url}:{port}/api/v1/prometheus".format(
     base_url=os.environ.get("METRICS_ENDPOINT_URL"),
     port=os.environ.get("METRICS_ENDPOINT_URL_PORT"))
@@ -96,30 +115,116 @@ def format_date(date):
     return date
 
 
+def get_osio_user_counts(epvs):
+    """Get # of uses for each of the given (ecosystem, name, version) from graph.
+
+    Counts are served from cache when possible, the rest is fetched in one
+    query per GREMLIN_QUERY_SIZE batch. Unresolved counts are reported as -1.
+    """
+    query = "counts = []; epvs.each { counts.add(g.V().has('pecosystem', it.ecosystem)." \
+            "has('pname', it.name).has('version', it.version).in('uses').count().next()) }; " \
+            "counts;"
+    user_counts = {}
+    missing = []
+    for epv in dict.fromkeys(epvs):
+        count = _osio_user_count_cache.get(epv)
+        if count is None:
+            missing.append(epv)
+        else:
+            user_counts[epv] = count
+
+    for i in range(0, len(missing), GREMLIN_QUERY_SIZE):
+        batch = missing[i:i + GREMLIN_QUERY_SIZE]
+        payload = {
+            'gremlin': query,
+            'bindings': {
+                'epvs': [{'ecosystem': eco, 'name': name, 'version': version}
+                         for eco, name, version in batch]
+            }
+        }
+        json_response = post_http_request(url=GREMLIN_SERVER_URL_REST, payload=payload)
+        counts = get_response_data(json_response or {}, [])
+        if len(counts) != len(batch):
+            logger.error("Unexpected osio user count response for {} epvs".format(len(batch)))
+            continue
+        for epv, count in zip(batch, counts):
+            _osio_user_count_cache.put(epv, count)
+            user_counts[epv] = count
+
+    return {epv: user_counts.get(epv, -1) for epv in epvs}
+
+
 def get_osio_user_count(ecosystem, name, version):
     """Send query to the graph database to get # of uses for the provided E+P+V."""
-    str_gremlin = "g.V().has('pecosystem','{}').has('pname','{}').has('version','{}').".format(
-        ecosystem, name, version)
-    str_gremlin += "in('uses').count();"
-    payload = {
-        'gremlin': str_gremlin
-    }
+    epv = (ecosystem, name, version)
+    return get_osio_user_counts([epv])[epv]
 
-    json_response = post_http_request(url=GREMLIN_SERVER_URL_REST, payload=payload)
-    return json_response.get('result').get('data', ['-1'])[0]
 
+def index_insights_packages(insights_packages):
+    """Index insights (kronos) package entries by package_name.
 
-def create_package_dict(graph_results, alt_dict=None):
-    """Convert Graph Results into the Recommendation Dict."""
-    pkg_list = []
+    Accepts a list of entries or a dict of such lists, later entries of the
+    same package win.
+    """
+    if isinstance(insights_packages, dict):
+        insights_packages = (pkg for pkgs in insights_packages.values() for pkg in pkgs)
+    return {pkg.get('package_name', ''): pkg for pkg in insights_packages}
+
+
+class LazyJSON:
+    """Log argument rendering obj as JSON only when the record is emitted.
+
+    The rendered text is capped at max_chars.
+    """
+
+    def __init__(self, obj, max_chars: int = 1024):
+        """Wrap obj."""
+        self._obj = obj
+        self._max_chars = max_chars
 
+    def __str__(self):
+        """Return JSON of obj, truncated to max_chars."""
+        text = json.dumps(self._obj, default=str)
+        if len(text) <= self._max_chars:
+            return text
+        return '{}... ({} chars)'.format(text[:self._max_chars], len(text))
+
+
+def partition_by_package_name(epv_list, package_names):
+    """Split graph EPVs into the ones not named in package_names and the names filtered out.
+
+    epv_list is not modified.
+    """
+    package_names = set(package_names)
+    kept = []
+    filtered_names = []
+    for epv in epv_list:
+        name = epv.get('package', {}).get('name', [''])[0]
+        if name in package_names:
+            filtered_names.append(name)
+        else:
+            kept.append(epv)
+    return kept, filtered_names
+
+
+def create_package_dict(graph_results, alt_dict=None, pgm_index=None):
+    """Convert Graph Results into the Recommendation Dict.
+
+    With pgm_index, see index_insights_packages, topics and cooccurrence of
+    the companion packages are taken from it instead of the graph records.
+    """
+    pkg_list = []
+    epvs = []
     for epv in graph_results:
-        ecosystem = epv.get('version', {}).get('pecosystem', [''])[0]
-        name = epv.get('version', {}).get('pname', [''])[0]
-        version = epv.get('version', {}).get('version', [''])[0]
+        epvs.append((epv.get('version', {}).get('pecosystem', [''])[0],
+                     epv.get('version', {}).get('pname', [''])[0],
+                     epv.get('version', {}).get('version', [''])[0]))
+    # fetch osio_user_count of all the EPVs at once
+    osio_user_counts = get_osio_user_counts([epv for epv in epvs if all(epv)])
+
+    for epv, (ecosystem, name, version) in zip(graph_results, epvs):
         if ecosystem and name and version:
-            # TODO change this logic later to fetch osio_user_count
-            osio_user_count = get_osio_user_count(ecosystem, name, version)
+            osio_user_count = osio_user_counts[(ecosystem, name, version)]
             pkg_dict = {
                 'ecosystem': ecosystem,
                 'name': name,
@@ -191,6 +296,12 @@ def create_package_dict(graph_results, alt_dict=None):
                 "total_files": epv['version'].get('cm_num_files', [-1])[0]
             }
 
+            pgm_epv = pgm_index.get(name) if pgm_index is not None else None
+            if pgm_epv is not None:
+                pkg_dict['topic_list'] = pgm_epv.get('topic_list', [])
+                pkg_dict['cooccurrence_probability'] = pgm_epv.get('cooccurrence_probability', 0)
+                pkg_dict['cooccurrence_count'] = pgm_epv.get('cooccurrence_count', 0)
+
             if alt_dict is not None and name in alt_dict:
                 pkg_dict['replaces'] = [{
                     'name': alt_dict[name]['replaces'],
@@ -201,32 +312,43 @@ def create_package_dict(graph_results, alt_dict=None):
     return pkg_list
 
 
+@functools.lru_cache(maxsize=Settings().version_cache_size)
+def _coerce_version(version):
+    """Coerce raw version string into semantic version, None if it can not be done."""
+    try:
+        """Needed for maven version like 1.5.2.RELEASE to be converted to
+        1.5.2 - RELEASE for semantic version to work."""
+        version = version.replace('.', '-', 3)
+        version = version.replace('-', '.', 2)
+        # Needed to add this so that -RELEASE is account as a Version.build
+        version = version.replace('-', '+', 3)
+        return sv.Version.coerce(version)
+    except (AttributeError, ValueError):
+        return None
+
+
 def convert_version_to_proper_semantic(version, package_name=None):
     """Perform Semantic versioning.
 
+    Conversions are memoized, the returned versions are shared and must not be modified.
+
     : type version: string
     : param version: The raw input version that needs to be converted.
     : type return: semantic_version.base.Version
     : return: The semantic version of raw input version.
     """
-    conv_version = sv.Version.coerce('0.0.0')
+    if version in ('', '-1', None):
+        return zero_version
     try:
-        if version in ('', '-1', None):
-            version = '0.0.0'
-        """Needed for maven version like 1.5.2.RELEASE to be converted to
-        1.5.2 - RELEASE for semantic version to work."""
-        version = version.replace('.', '-', 3)
-        version = version.replace('-', '.', 2)
-        # Needed to add this so that -RELEASE is account as a Version.build
-        version = version.replace('-', '+', 3)
-        conv_version = sv.Version.coerce(version)
-    except ValueError:
-        current_app.logger.info(
-            "Unexpected ValueError for the package {} due to version {}"
-            .format(package_name, version))
-        pass
-    finally:
-        return conv_version
+        conv_version = _coerce_version(version)
+    except TypeError:
+        # unhashable version
+        conv_version = None
+    if conv_version is None:
+        logger.info("Unexpected ValueError for the package {} due to version {}"
+                    .format(package_name, version))
+        return zero_version
+    return conv_version
 
 
 def version_info_tuple(version):
@@ -244,24 +366,26 @@ def version_info_tuple(version):
     return (0, 0, 0, tuple())
 
 
+@functools.lru_cache(maxsize=Settings().version_cache_size)
+def version_sort_key(version):
+    """Return memoized version_info_tuple of the raw version string.
+
+    Keys of different versions are compared as plain tuples.
+    """
+    return version_info_tuple(convert_version_to_proper_semantic(version))
+
+
 def select_latest_version(input_version='', libio='', anitya='', package_name=None):
     """Select latest version from input sequence(s)."""
-    libio_sem_version = convert_version_to_proper_semantic(libio, package_name)
-    anitya_sem_version = convert_version_to_proper_semantic(
-        anitya, package_name)
-    input_sem_version = convert_version_to_proper_semantic(
-        input_version, package_name)
     return_version = ''
     try:
-        if libio_sem_version == zero_version\
-                and anitya_sem_version == zero_version\
-                and input_sem_version == zero_version:
+        libio_tuple = version_sort_key(libio)
+        anitya_tuple = version_sort_key(anitya)
+        input_tuple = version_sort_key(input_version)
+        if libio_tuple == anitya_tuple == input_tuple == _zero_version_key:
             return_version = ''
         else:
             return_version = input_version
-            libio_tuple = version_info_tuple(libio_sem_version)
-            anitya_tuple = version_info_tuple(anitya_sem_version)
-            input_tuple = version_info_tuple(input_sem_version)
             if libio_tuple >= anitya_tuple and libio_tuple >= input_tuple:
                 return_version = libio
             elif anitya_tuple >= libio_tuple and anitya_tuple >= input_tuple:
@@ -280,6 +404,24 @@ def select_latest_version(input_version='', libio='', anitya='', package_name=No
         return return_version
 
 
+def select_max_version(versions):
+    """Select latest of the given versions in a single pass.
+
+    Same as folding select_latest_version over versions, but every version is
+    parsed at most once. Of equal versions the first one wins, '' is returned
+    when none of them is a valid non zero version or any of them can't be parsed.
+    """
+    try:
+        keyed = [(version_sort_key(version), version) for version in versions]
+    except (TypeError, ValueError):
+        logger.info("Unexpected error while selecting max of versions %s", LazyJSON(versions))
+        return ''
+    latest_key, latest = max(keyed, key=lambda pair: pair[0], default=(_zero_version_key, ''))
+    if latest_key == _zero_version_key:
+        return ''
+    return latest
+
+
 def get_session_retry(retries=3, backoff_factor=0.2, status_forcelist=(404, 500, 502, 504),
                       session=None):
     """Set HTTP Adapter with retries to session."""
@@ -291,6 +433,76 @@ def get_session_retry(retries=3, backoff_factor=0.2, status_forcelist=(404, 500,
     return session
 
 
+class _PooledSession(requests.Session):
+    """Session which applies a default timeout to every request."""
+
+    def __init__(self, timeout):
+        """Create session with the given default timeout."""
+        super().__init__()
+        self.timeout = timeout
+
+    def request(self, method, url, **kwargs):
+        """Send request, falling back to the session timeout."""
+        kwargs.setdefault('timeout', self.timeout)
+        return super().request(method, url, **kwargs)
+
+
+def get_http_session(upstream, retries=3, backoff_factor=0.2,
+                     status_forcelist=(404, 500, 502, 504)):
+    """Return process wide keep-alive session for the given upstream.
+
+    Sessions are created lazily and shared by all threads, pool size and
+    timeout are read from Settings as <upstream>_http_pool_size and
+    <upstream>_http_timeout.
+    """
+    session = _http_sessions.get(upstream)
+    if session is not None:
+        return session
+    with _http_sessions_lock:
+        if upstream not in _http_sessions:
+            settings = Settings()
+            pool_size = getattr(settings, '{}_http_pool_size'.format(upstream))
+            session = _PooledSession(getattr(settings, '{}_http_timeout'.format(upstream)))
+            retry = Retry(total=retries, read=retries, connect=retries,
+                          backoff_factor=backoff_factor, status_forcelist=status_forcelist)
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size,
+                                  max_retries=retry)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _http_sessions[upstream] = session
+        return _http_sessions[upstream]
+
+
+def get_http_pool_stats():
+    """Return connection reuse counters of each upstream connection pool."""
+    with _http_sessions_lock:
+        sessions = dict(_http_sessions)
+    stats = {}
+    for upstream, session in sessions.items():
+        pools = session.get_adapter('http://').poolmanager.pools
+        num_requests = num_connections = 0
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is not None:
+                num_requests += pool.num_requests
+                num_connections += pool.num_connections
+        stats[upstream] = {
+            'requests': num_requests,
+            'connections': num_connections,
+            'reused': max(num_requests - num_connections, 0)
+        }
+    return stats
+
+
+def _get_upstream_for_url(url):
+    """Map url to the upstream whose connection pool serves it."""
+    if url.startswith(GREMLIN_SERVER_URL_REST):
+        return UPSTREAM_GREMLIN
+    if url.startswith(LICENSE_SCORING_URL_REST):
+        return UPSTREAM_LICENSE
+    return UPSTREAM_INSIGHTS
+
+
 def is_quickstart_majority(package_list=[]):
     """Return true if 50% or more packages are from quickstarts.
 
@@ -306,7 +518,12 @@ def is_quickstart_majority(package_list=[]):
 
 
 def persist_data_in_db(external_request_id, task_result, worker, started_at=None, ended_at=None):
-    """Persist the data in Postgres."""
+    """Persist the data in Postgres.
+
+    EncodedJSON task_result is sent as its JSON text, it isn't serialized again.
+    """
+    if isinstance(task_result, EncodedJSON):
+        task_result = cast(literal(task_result.encoded.decode('utf-8'), String), JSONB)
     try:
         insert_stmt = insert(WorkerResult).values(
             worker=worker, worker_id=None,
@@ -326,7 +543,7 @@ def persist_data_in_db(external_request_id, task_result, worker, started_at=None
 def post_http_request(url, payload):
     """Post the given payload to url."""
     try:
-        response = get_session_retry().post(url=url, json=payload)
+        response = get_http_session(_get_upstream_for_url(url)).post(url=url, json=payload)
         if response.status_code == 200:
             return response.json()
         else:
@@ -342,13 +559,24 @@ def post_http_request(url, payload):
 
 def post_gremlin(query: str, bindings: Dict = None) -> Dict:
     """Post the given query and bindings to gremlin endpoint."""
+    client = get_gremlin_ws_client()
+    if client is not None:
+        try:
+            return post_gremlin_ws(client, query, bindings)
+        except Exception as e:
+            if not is_ws_connection_error(e):
+                logger.error(traceback.format_exc())
+                raise GremlinExeception from e
+            logger.warning("gremlin websocket connection failed, retrying over REST",
+                           exc_info=True)
     try:
         payload = {
             'gremlin': query,
         }
         if bindings:
             payload['bindings'] = bindings
-        response = get_session_retry().post(url=GREMLIN_SERVER_URL_REST, json=payload)
+        response = get_http_session(UPSTREAM_GREMLIN).post(
+            url=GREMLIN_SERVER_URL_REST, json=payload)
         response.raise_for_status()
         return response.json()
     except Exception as e:
@@ -0,0 +1,264 @@
+"""Read-only memory-mapped snapshot of the graph records used by the aggregator.
+
+A snapshot holds the package, version and vulnerability record of every EPV
+keyed by (ecosystem, name, version), in the format returned by the epv details
+query of one projection. The file is mapped read-only, so gunicorn workers of a host share its
+pages through the page cache, and lookups are a binary search over the mapping.
+
+File layout, integers are little endian:
+
+    header  magic (8 bytes) | entry count (u32) | index offset (u64) | build time (u64) |
+            projection (16 bytes)
+    data    key | value, for every entry
+    index   key offset (u64) | key length (u32) | value offset (u64) | value length (u32),
+            for every entry sorted by key
+
+Keys are ecosystem, name and version joined by NUL, values are JSON records.
+Build time is in seconds since the epoch, snapshots older than epv_snapshot_max_age
+are not used. Projection is the NUL padded name of the aggregator projection the
+records were queried with, graph exports use the registered one.
+
+Snapshots are built with:
+
+    python -m src.v2.epv_snapshot OUTPUT --ecosystem pypi
+    python -m src.v2.epv_snapshot OUTPUT --projection freetier \
+        --responses recorded_gremlin_response.json ...
+"""
+
+import argparse
+import inspect
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+
+from typing import Dict, Iterable, Iterator, List, Optional
+from src.settings import Settings
+from src.utils import post_gremlin, GREMLIN_QUERY_SIZE
+
+logger = logging.getLogger(__file__)  # pylint:disable=C0103
+
+_MAGIC = b'EPVSNAP3'
+_HEADER = struct.Struct('<8sIQQ16s')
+_PROJECTIONS = ('freetier', 'registered')
+_INDEX_ENTRY = struct.Struct('<QIQI')
+# next page of package names of an ecosystem, the ones sorted after the given name.
+_PACKAGE_NAMES_QUERY = inspect.cleandoc("""
+    g.V().has('ecosystem', ecosystem).has('name', gt(after)).
+    order().by('name').limit(page_size).values('name');
+    """)
+# (name, version) of every version of the given packages.
+_EPV_KEYS_QUERY = inspect.cleandoc("""
+    g.V().has('ecosystem', ecosystem).has('name', within(names)).
+    out('has_version').project('name', 'version').by('pname').by('version');
+    """)
+
+
+class EPVSnapshotError(Exception):
+    """Snapshot file is malformed."""
+
+
+def _encode_key(ecosystem: str, name: str, version: str) -> bytes:
+    return '\0'.join((ecosystem, name, version)).encode('utf-8')
+
+
+def _record_key(record: Dict[str, object]) -> bytes:
+    """Encode (ecosystem, name, version) key of a graph record."""
+    version_node = record.get('version', {})
+    return _encode_key(version_node.get('pecosystem', [''])[0],
+                       version_node.get('pname', [''])[0],
+                       version_node.get('version', [''])[0])
+
+
+class EPVSnapshot:
+    """Lookup graph records of EPVs in a memory-mapped snapshot file."""
+
+    def __init__(self, path: str):
+        """Map the snapshot file at path."""
+        with open(path, 'rb') as fin:
+            self._mm = mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._mm) < _HEADER.size:
+            raise EPVSnapshotError('{} is too short for a snapshot'.format(path))
+        magic, self._count, self._index_offset, self.built_at, projection = \
+            _HEADER.unpack_from(self._mm, 0)
+        if (magic != _MAGIC or
+                self._index_offset + self._count * _INDEX_ENTRY.size > len(self._mm)):
+            raise EPVSnapshotError('{} is not a valid snapshot'.format(path))
+        self.projection = projection.rstrip(b'\0').decode('ascii')
+        self.path = path
+
+    def __len__(self):
+        """Return number of EPVs in the snapshot."""
+        return self._count
+
+    def get(self, ecosystem: str, name: str, version: str) -> Optional[Dict[str, object]]:
+        """Return graph record of the EPV, None if it is not in the snapshot."""
+        key = _encode_key(ecosystem, name, version)
+        low, high = 0, self._count
+        while low < high:
+            mid = (low + high) // 2
+            key_offset, key_len, value_offset, value_len = _INDEX_ENTRY.unpack_from(
+                self._mm, self._index_offset + mid * _INDEX_ENTRY.size)
+            mid_key = self._mm[key_offset:key_offset + key_len]
+            if mid_key < key:
+                low = mid + 1
+            elif mid_key > key:
+                high = mid
+            else:
+                return json.loads(self._mm[value_offset:value_offset + value_len])
+        return None
+
+
+def write_snapshot(path: str, records: Iterable[Dict[str, object]], projection: str,
+                   built_at: int = None) -> int:
+    """Write snapshot of the given graph records of projection to path, return number of EPVs.
+
+    Of records with the same EPV the first one is kept. The file is replaced
+    atomically, workers having the old one mapped keep reading it. Build time
+    defaults to now.
+    """
+    if projection not in _PROJECTIONS:
+        raise ValueError('unknown projection {}'.format(projection))
+    if built_at is None:
+        built_at = int(time.time())
+    values = {}
+    for record in records:
+        key = _record_key(record)
+        if key not in values:
+            values[key] = json.dumps(record, separators=(',', ':')).encode('utf-8')
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp_path, 'wb') as fout:
+        header = (built_at, projection.encode('ascii'))
+        offset = fout.write(_HEADER.pack(_MAGIC, 0, 0, *header))
+        index = []
+        for key in sorted(values):
+            value = values[key]
+            fout.write(key)
+            fout.write(value)
+            index.append(_INDEX_ENTRY.pack(offset, len(key), offset + len(key), len(value)))
+            offset += len(key) + len(value)
+        fout.write(b''.join(index))
+        fout.seek(0)
+        fout.write(_HEADER.pack(_MAGIC, len(index), offset, *header))
+    os.replace(tmp_path, path)
+    return len(values)
+
+
+def iter_recorded_records(paths: Iterable[str]) -> Iterator[Dict[str, object]]:
+    """Yield records of the given files of recorded post_gremlin responses.
+
+    The responses are taken as they are, the snapshot is marked with the
+    projection they were queried with by the caller.
+    """
+    for path in paths:
+        with open(path) as fin:
+            response = json.load(fin)
+        yield from (response.get('result') or {}).get('data') or []
+
+
+def iter_graph_records(ecosystem: str, page_size: int = 1000) -> Iterator[Dict[str, object]]:
+    """Yield records of every EPV of the ecosystem found in graph.
+
+    Packages are paged in name order, every page starts after the last name of
+    the previous one. So pages are stable and each one is a range of the name index.
+    """
+    # the same query and projection as registered users, a superset of free tier.
+    from src.v2.stack_aggregator import Registered
+
+    after = ''
+    while True:
+        result = post_gremlin(_PACKAGE_NAMES_QUERY,
+                              {'ecosystem': ecosystem, 'after': after, 'page_size': page_size})
+        names: List[str] = result['result']['data'] if result else []
+        if not names:
+            return
+        after = names[-1]
+        result = post_gremlin(_EPV_KEYS_QUERY, {'ecosystem': ecosystem, 'names': names})
+        keys: List[Dict[str, str]] = result['result']['data'] if result else []
+        for i in range(0, len(keys), GREMLIN_QUERY_SIZE):
+            bindings = {
+                'ecosystem': ecosystem,
+                'packages': keys[i:i + GREMLIN_QUERY_SIZE]
+            }
+            result = post_gremlin(Registered._epv_details_query, bindings)
+            yield from result['result']['data'] if result else []
+
+
+_snapshot_lock = threading.Lock()
+# snapshot in use, the mapped file and when it was checked last, on the monotonic clock.
+_snapshot = {'snapshot': None, 'mapped': None, 'signature': None,
+             'checked_at': None, 'check_interval': 0.0}
+
+
+def _check_snapshot():
+    """Map the configured snapshot file again if it was replaced, drop it once too old."""
+    settings = Settings()
+    path = settings.epv_snapshot_path
+    _snapshot['checked_at'] = time.monotonic()
+    _snapshot['check_interval'] = settings.epv_snapshot_check_interval
+    _snapshot['snapshot'] = None
+    if not path:
+        return
+    try:
+        stat = os.stat(path)
+        signature = (path, stat.st_ino, stat.st_mtime_ns)
+        if _snapshot['signature'] != signature:
+            _snapshot['mapped'] = EPVSnapshot(path)
+            _snapshot['signature'] = signature
+            logger.info('mapped epv snapshot %s with %d entries', path,
+                        len(_snapshot['mapped']))
+    except (OSError, EPVSnapshotError):
+        logger.exception('epv snapshot %s can not be used', path)
+        return
+    age = time.time() - _snapshot['mapped'].built_at
+    if age > settings.epv_snapshot_max_age:
+        logger.warning('epv snapshot %s is %d seconds old, it is not used', path, age)
+        return
+    _snapshot['snapshot'] = _snapshot['mapped']
+
+
+def get_epv_snapshot() -> Optional[EPVSnapshot]:
+    """Return snapshot configured by epv_snapshot_path, None if there is none.
+
+    The file is checked every epv_snapshot_check_interval seconds. It is mapped
+    again once it is replaced, and not used once it is older than epv_snapshot_max_age.
+    """
+    checked_at = _snapshot['checked_at']
+    if checked_at is None or time.monotonic() - checked_at >= _snapshot['check_interval']:
+        with _snapshot_lock:
+            if _snapshot['checked_at'] == checked_at:
+                _check_snapshot()
+    return _snapshot['snapshot']
+
+
+def main(argv: List[str] = None):
+    """Build snapshot from graph or from recorded gremlin responses."""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument('output', help='path of the snapshot file')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--ecosystem', action='append',
+                        help='export every EPV of the ecosystem from graph')
+    source.add_argument('--responses', nargs='+', metavar='FILE',
+                        help='JSON files of recorded post_gremlin responses')
+    parser.add_argument('--projection', choices=_PROJECTIONS,
+                        help='projection the recorded responses were queried with')
+    args = parser.parse_args(argv)
+    if args.responses:
+        if args.projection is None:
+            parser.error('--projection is required with --responses')
+        records = iter_recorded_records(args.responses)
+        projection = args.projection
+    else:
+        records = (record for ecosystem in args.ecosystem
+                   for record in iter_graph_records(ecosystem))
+        projection = 'registered'
+    count = write_snapshot(args.output, records, projection)
+    print('wrote {} EPVs to {}'.format(count, args.output))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -211,6 +211,12 @@ class StackAggregatorResultForRegisteredUser(StackAggregatorResult):  # noqa: D1
         None,
         description="All direct dependencies details regardless of it's vulnerability status\n",
     )
+    vulnerable_dependency_details: Optional[List['PackageDetailsForRegisteredUser']] = Field(
+        None,
+        description=('Vulnerable transitive dependencies details, referenced by name and '
+                     'version\nfrom dependencies of analyzed_dependencies. Only in '
+                     'normalized responses.\n'),
+    )
 
 
 class StackAggregatorResultForFreeTier(StackAggregatorResult):  # noqa: D101
@@ -219,6 +225,12 @@ class StackAggregatorResultForFreeTier(StackAggregatorResult):  # noqa: D101
         None,
         description="All direct dependencies details regardless of it's vulnerability status\n",
     )
+    vulnerable_dependency_details: Optional[List['PackageDetailsForFreeTier']] = Field(
+        None,
+        description=('Vulnerable transitive dependencies details, referenced by name and '
+                     'version\nfrom dependencies of analyzed_dependencies. Only in '
+                     'normalized responses.\n'),
+    )
 
 
 class StackAggregatorRequest(BaseModel):  # noqa: D101
@@ -229,6 +241,12 @@ class StackAggregatorRequest(BaseModel):  # noqa: D101
         True,
         description='This is required to enable or disable the transitive support\n',
     )
+    normalized_response: Optional[bool] = Field(
+        False,
+        description=('List vulnerable transitive dependencies once in '
+                     'vulnerable_dependency_details\ninstead of under every direct '
+                     'dependency depending on them\n'),
+    )
     ecosystem: 'Ecosystem'
     manifest_file: str
     manifest_file_path: str
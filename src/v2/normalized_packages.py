@@ -1,48 +1,66 @@
 """Abstraction for various response models used in V2 implementation."""
 
 from collections import defaultdict
-from typing import List, Tuple, Dict, Set
+from typing import List, NamedTuple, Tuple, Dict, Set
 from src.v2.models import Package, Ecosystem
 
 
+class PackageKey(NamedTuple):
+    """Immutable name and version of a package, used as key instead of Package.
+
+    Hashes equal to the Package of the same name and version.
+    """
+
+    name: str
+    version: str
+
+    def to_package(self) -> Package:
+        """Convert to Package model."""
+        return Package(name=self.name, version=self.version)
+
+
 class NormalizedPackages:
     """Duplicate free Package List."""
 
     def __init__(self, packages: List[Package], ecosystem: Ecosystem):
-        """Create NormalizedPackages by removing all duplicates from packages."""
+        """Create NormalizedPackages by removing all duplicates from packages.
+
+        Every distinct name and version is represented by a single PackageKey.
+        """
         self._packages = packages
         self._ecosystem = ecosystem
-        self._dependency_graph: Dict[Package, Set[Package]] = defaultdict(set)
+        keys: Dict[PackageKey, PackageKey] = {}
+        self._dependency_graph: Dict[PackageKey, Set[PackageKey]] = defaultdict(set)
         for package in packages:
-            # clone without dependencies field
-            package_clone = Package(name=package.name, version=package.version)
-            self._dependency_graph[package_clone] = self._dependency_graph[package_clone] or set()
+            key = PackageKey(package.name, package.version)
+            transitives = self._dependency_graph[keys.setdefault(key, key)]
             for trans_package in package.dependencies or []:
-                trans_clone = Package(name=trans_package.name, version=trans_package.version)
-                self._dependency_graph[package].add(trans_clone)
-        # unfold set of Package into flat set of Package
-        self._transtives: Set[Package] = {d for dep in self._dependency_graph.values() for d in dep}
+                key = PackageKey(trans_package.name, trans_package.version)
+                transitives.add(keys.setdefault(key, key))
+        # unfold set of PackageKey into flat set of PackageKey
+        self._transtives: Set[PackageKey] = {d for dep in self._dependency_graph.values()
+                                             for d in dep}
         self._directs = frozenset(self._dependency_graph.keys())
         self._all = self._directs.union(self._transtives)
 
     @property
-    def direct_dependencies(self) -> Tuple[Package]:
-        """Immutable list of direct dependency Package."""
+    def direct_dependencies(self) -> Tuple[PackageKey]:
+        """Immutable list of direct dependency PackageKey."""
         return tuple(self._directs)
 
     @property
-    def transitive_dependencies(self) -> Tuple[Package]:
-        """Immutable list of transitives dependency Package."""
+    def transitive_dependencies(self) -> Tuple[PackageKey]:
+        """Immutable list of transitives dependency PackageKey."""
         return tuple(self._transtives)
 
     @property
-    def all_dependencies(self) -> Tuple[Package]:
+    def all_dependencies(self) -> Tuple[PackageKey]:
         """Union of all direct and transitives without duplicates."""
         return tuple(self._all)
 
     @property
-    def dependency_graph(self) -> Dict[Package, Set[Package]]:
-        """Return Package with it's transtive without duplicates."""
+    def dependency_graph(self) -> Dict[PackageKey, Set[PackageKey]]:
+        """Return PackageKey with it's transtive without duplicates."""
         return self._dependency_graph
 
     @property
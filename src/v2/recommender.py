@@ -4,6 +4,7 @@ It also gives a list of packages that are not known to the recommendation engine
 sourcing.
 """
 
+import inspect
 import json
 import datetime
 import requests
@@ -11,16 +12,32 @@ import os
 from collections import defaultdict
 import logging
 
-from src.utils import (create_package_dict, get_session_retry, select_latest_version,
-                       LICENSE_SCORING_URL_REST, convert_version_to_proper_semantic,
-                       get_response_data, version_info_tuple, persist_data_in_db,
-                       is_quickstart_majority, post_gremlin)
+from src.utils import (create_package_dict, index_insights_packages,
+                       partition_by_package_name, LazyJSON,
+                       get_http_session, select_latest_version,
+                       LICENSE_SCORING_URL_REST, get_response_data,
+                       version_sort_key, persist_data_in_db,
+                       is_quickstart_majority, post_gremlin, GREMLIN_QUERY_SIZE,
+                       UPSTREAM_LICENSE, UPSTREAM_INSIGHTS)
 from src.v2.models import RecommenderRequest
 from src.v2.stack_aggregator import extract_user_stack_package_licenses
 from src.v2.normalized_packages import NormalizedPackages
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__file__)
+# latest non cve and latest version of each of the packages, names are bound in batches.
+# versions are looked up through the (pecosystem, pname, version) index, one name at a time.
+_VERSION_INFORMATION_QUERY = inspect.cleandoc("""
+    data = [];
+    names.each { name ->
+        def pkg = g.V().has('ecosystem', eco).has('name', name);
+        def lnv = []; pkg.clone().values('latest_non_cve_version', 'latest_version').fill(lnv);
+        pkg.clone().as('package').V().
+        has('pecosystem', eco).has('pname', name).has('version', within(lnv)).as('version').
+        select('package', 'version').by(valueMap()).fill(data);
+    };
+    data
+    """)
 
 
 class GraphDB:
@@ -32,23 +49,18 @@ class GraphDB:
 
         Also remove EPVs with CVEs and ones not present in Graph
         """
-        str_query = "data=[]; "
-        for package in input_list:
-            str_query += "pkg = g.V().has('ecosystem', '{eco}').has('name', '{pkg}'); " \
-                         "lnv = []; pkg.clone().values('latest_non_cve_version', " \
-                         "'latest_version').fill(lnv); pkg.clone().as('package').V()." \
-                         "has('pecosystem', '{eco}').has('pname', '{pkg}')." \
-                         "has('version', within(lnv)).as('version')." \
-                         "select('package', 'version').by(valueMap()).fill(data);".format(
-                                                                                    eco=ecosystem,
-                                                                                    pkg=package)
-        str_query += "data"
-        # Query Gremlin with packages list to get their version information
-        gremlin_response = post_gremlin(str_query)
-        if gremlin_response is None:
-            return []
-        response = get_response_data(gremlin_response, [{0: 0}])
-        return response
+        data = []
+        names = sorted(set(input_list))
+        for i in range(0, len(names), GREMLIN_QUERY_SIZE):
+            bindings = {
+                'eco': ecosystem,
+                'names': names[i:i + GREMLIN_QUERY_SIZE]
+            }
+            # Query Gremlin with packages list to get their version information
+            gremlin_response = post_gremlin(_VERSION_INFORMATION_QUERY, bindings)
+            if gremlin_response is not None:
+                data += get_response_data(gremlin_response, [])
+        return data
 
     @staticmethod
     def add_version_to_filtered_list(epv, key, val, semversion_tuple, input_stack_tuple,
@@ -110,10 +122,8 @@ class GraphDB:
             latest_version = epv.get('package').get('latest_version', [''])[0]
 
             # Convert version to a proper semantic case
-            semversion_tuple = version_info_tuple(
-                convert_version_to_proper_semantic(version, name))
-            input_stack_tuple = version_info_tuple(
-                convert_version_to_proper_semantic(input_stack.get(name, ''), name))
+            semversion_tuple = version_sort_key(version)
+            input_stack_tuple = version_sort_key(input_stack.get(name, ''))
 
             if name and version:
                 # Select highest version based on input or graph as latest version
@@ -161,21 +171,14 @@ class GraphDB:
         new_list = GraphDB.prepare_final_filtered_list(new_dict)
         return new_list, filtered_comp_list
 
-    @staticmethod
-    def get_topics_for_comp(comp_list, pgm_list):
-        """Get topics from pgm and associate with filtered versions from Graph."""
-        for epv in comp_list:
-            name = epv.get('package', {}).get('name', [''])[0]
-            if name:
-                for pgm_epv in pgm_list:
-                    if name == pgm_epv.get('package_name', ''):
-                        epv['package']['pgm_topics'] = pgm_epv.get('topic_list', [])
-                        epv['package']['cooccurrence_probability'] = pgm_epv.get(
-                            'cooccurrence_probability', 0)
-                        epv['package']['cooccurrence_count'] = pgm_epv.get(
-                            'cooccurrence_count', 0)
 
-        return comp_list
+def _get_license_scoring_input(epv):
+    """Create license scoring input of a graph EPV."""
+    return {
+        'package': epv.get('package', {}).get('name', [''])[0],
+        'version': epv.get('version', {}).get('version', [''])[0],
+        'licenses': epv.get('version', {}).get('declared_licenses', [])
+    }
 
 
 class License:
@@ -194,7 +197,8 @@ class License:
         json_response = {}
         try:
             # Call License service to get license data
-            lic_response = get_session_retry().post(license_url, data=json.dumps(payload))
+            lic_response = get_http_session(UPSTREAM_LICENSE).post(
+                license_url, data=json.dumps(payload))
             if lic_response.status_code != 200:
                 lic_response.raise_for_status()  # raise exception for bad http-status codes
             json_response = lic_response.json()
@@ -207,17 +211,8 @@ class License:
     @staticmethod
     def apply_license_filter(user_stack_components, epv_list_com):
         """Get License Analysis and filter out License Conflict EPVs."""
-        license_score_list_com = []
         conflict_packages_com = []
-        list_pkg_names_com = []
-
-        for epv in epv_list_com:
-            license_scoring_input = {
-                'package': epv.get('package', {}).get('name', [''])[0],
-                'version': epv.get('version', {}).get('version', [''])[0],
-                'licenses': epv.get('version', {}).get('declared_licenses', [])
-            }
-            license_score_list_com.append(license_scoring_input)
+        license_score_list_com = [_get_license_scoring_input(epv) for epv in epv_list_com]
 
         # Call license scoring to find license filters
         la_output = License.invoke_license_analysis_service(user_stack_components,
@@ -228,17 +223,15 @@ class License:
             conflict_packages_com = license_filter.get('companion_packages', {}) \
                 .get('conflict_packages', [])
 
-        for epv in epv_list_com[:]:
-            name = epv.get('package', {}).get('name', [''])[0]
-            if name in conflict_packages_com:
-                list_pkg_names_com.append(name)
-                epv_list_com.remove(epv)
+        epv_list_com, list_pkg_names_com = partition_by_package_name(epv_list_com,
+                                                                     conflict_packages_com)
 
         output = {
             'filtered_comp_packages_graph': epv_list_com,
             'filtered_list_pkg_names_com': list_pkg_names_com
         }
-        logger.info("License Filter output: {}".format(json.dumps(output)))
+        logger.info("License Filter output: kept %d companion packages, filtered %s",
+                    len(epv_list_com), LazyJSON(list_pkg_names_com))
 
         return output
 
@@ -335,7 +328,7 @@ class RecommendationTask:
             # TODO remove hardcodedness for payloads with multiple ecosystems
 
             insights_url = RecommendationTask.get_insights_url(payload)
-            response = get_session_retry().post(insights_url, json=payload)
+            response = get_http_session(UPSTREAM_INSIGHTS).post(insights_url, json=payload)
 
             if response.status_code != 200:
                 logger.error("HTTP error {}. Error retrieving insights data.".format(
@@ -447,13 +440,11 @@ class RecommendationTask:
                 else:
                     lic_filtered_comp_graph = filtered_comp_packages_graph
 
-                # Get Topics Added to Filtered Packages
-                topics_comp_packages_graph = GraphDB(). \
-                    get_topics_for_comp(lic_filtered_comp_graph,
-                                        insights_result.get('companion_packages', []))
-
-                # Create Companion Block
-                comp_packages = create_package_dict(topics_comp_packages_graph)
+                # Create Companion Block, topics are added from the indexed insights result
+                companion_index = index_insights_packages(
+                    insights_result.get('companion_packages', []))
+                comp_packages = create_package_dict(lic_filtered_comp_graph,
+                                                    pgm_index=companion_index)
                 final_comp_packages = \
                     set_valid_cooccurrence_probability(comp_packages)
 
@@ -4,60 +4,207 @@ Gathers component data from the graph database and aggregate the data to be pres
 by stack-analyses endpoint
 """
 
+import copy
 import datetime
 import inspect
+import itertools
 import time
 import logging
 
 from abc import ABC, abstractmethod
-from typing import Dict, List, Tuple, Union
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, Iterator, List, Tuple, Type, Union
+from pydantic import BaseModel
+from src.cache import LRUCache, SingleFlight
 from src.settings import Settings
-from src.utils import (select_latest_version, server_create_analysis,
-                       persist_data_in_db, post_gremlin, GREMLIN_QUERY_SIZE,
-                       format_date)
+from src.utils import (select_latest_version, select_max_version, server_create_analysis,
+                       persist_data_in_db, post_gremlin,
+                       GREMLIN_QUERY_SIZE, format_date, GremlinExeception)
+from src.batch_sizer import get_batch_sizer
+from src.gremlin_stream import post_gremlin_stream
+from src.json_encoding import EncodedJSON
 from src.v2.models import (StackAggregatorRequest, GitHubDetails, PackageDetails,
                            BasicVulnerabilityFields, PremiumVulnerabilityFields,
                            PackageDetailsForFreeTier,
                            PackageDetailsForRegisteredUser,
-                           Package, Audit, Ecosystem,
+                           Package, Audit, Ecosystem, Exploit, Severity, UsedByItem,
                            StackAggregatorResultForFreeTier,
                            StackAggregatorResultForRegisteredUser,
                            StackAggregatorResult)
-from src.v2.normalized_packages import NormalizedPackages
+from src.version_index import get_version_indexes
+from src.v2.epv_snapshot import get_epv_snapshot
+from src.v2.normalized_packages import NormalizedPackages, PackageKey
 from src.v2.license_service import (get_license_analysis_for_stack,
                                     get_license_service_request_payload)
 
 logger = logging.getLogger(__file__)  # pylint:disable=C0103
 _TRUE = ['true', True, 1, '1']
+# process wide pool shared by all requests to bound gremlin batch fan-out.
+_gremlin_batch_executor = ThreadPoolExecutor(
+    max_workers=Settings().gremlin_batch_max_workers,
+    thread_name_prefix='gremlin-batch')
+# graph records keyed by (ecosystem, name, version), shared by all requests. Records
+# are accounted at a typical encoded size rather than encoded again to be measured.
+_EPV_RECORD_BYTES = 2048
+_epv_cache = LRUCache(max_bytes=Settings().epv_cache_max_bytes,
+                      ttl=Settings().epv_cache_ttl,
+                      sizeof=lambda _: _EPV_RECORD_BYTES)
+# (ecosystem, name, version) known to be absent from graph, sized by entry count.
+_unknown_epv_cache = LRUCache(max_bytes=Settings().unknown_epv_cache_max_entries,
+                              ttl=Settings().unknown_epv_cache_ttl)
+# (ecosystem, name, version) being fetched from graph by some request right now.
+_epv_flights = SingleFlight()
+
+
+def get_epv_lookup_stats() -> Dict[str, Dict[str, int]]:
+    """Return counters of the graph record caches and coalesced lookups of this process."""
+    return {
+        'epv_cache': _epv_cache.stats(),
+        'unknown_epv_cache': _unknown_epv_cache.stats(),
+        'epv_flights': _epv_flights.stats()
+    }
+
+
+def _select_recommended_version(pkg: Package, versions: List[str]) -> str:
+    """Select highest of the given non vulnerable versions if it is not pkg.version."""
+    rec_version = select_max_version([pkg.version] + list(versions))
+    if rec_version == pkg.version:
+        return None
+    return rec_version
+
+
+def get_recommended_versions(ecosystem: Ecosystem,
+                             pkgs: List[Package]) -> Dict[Package, str]:
+    """Fetch the recommended version of all the given packages in case of CVEs."""
+    if Settings().version_index_enabled:
+        indexes = get_version_indexes(ecosystem, (pkg.name for pkg in pkgs), 'has_snyk_cve')
+        return {pkg: indexes[pkg.name].recommended_version(pkg.version)
+                if pkg.name in indexes else None for pkg in pkgs}
+    query = """
+            g.V().has('ecosystem', eco).has('name', within(names)).
+            group().by('name').
+            by(out('has_version').not(out('has_snyk_cve')).values('version').fold());
+            """
+    query = inspect.cleandoc(query)
+    names = sorted({pkg.name for pkg in pkgs})
+    versions_by_name = {}
+    for batch in _get_packages_in_batch(names, GREMLIN_QUERY_SIZE):
+        bindings = {
+            'eco': ecosystem,
+            'names': batch
+        }
+        result = post_gremlin(query, bindings)
+        if result:
+            for group in result['result']['data']:
+                versions_by_name.update(group)
+
+    recommended_versions = {}
+    for pkg in pkgs:
+        recommended_versions[pkg] = _select_recommended_version(
+            pkg, versions_by_name.get(pkg.name, []))
+    return recommended_versions
 
 
 def get_recommended_version(ecosystem: Ecosystem, pkg: Package) -> str:
     """Fetch the recommended version in case of CVEs."""
+    return get_recommended_versions(ecosystem, [pkg]).get(pkg)
+
+
+# graph properties read while building the response, only these are fetched.
+_VERSION_PROPERTIES = ('pecosystem', 'pname', 'version', 'declared_licenses')
+_PACKAGE_PROPERTIES = (
+    'latest_non_cve_version', 'libio_latest_version', 'latest_version',
+    # _get_github_details
+    'gh_refreshed_on', 'libio_dependents_projects', 'libio_dependents_repos',
+    'libio_total_releases', 'libio_latest_release', 'libio_usedby',
+    'gh_issues_last_month_opened', 'gh_issues_last_month_closed',
+    'gh_issues_last_year_opened', 'gh_issues_last_year_closed',
+    'gh_prs_last_month_opened', 'gh_prs_last_month_closed',
+    'gh_prs_last_year_opened', 'gh_prs_last_year_closed',
+    'gh_stargazers', 'gh_forks', 'gh_open_issues_count', 'gh_contributors_count')
+# _get_vuln_for_free_tier
+_FREE_TIER_VULNERABILITY_PROPERTIES = (
+    'snyk_pvt_vulnerability', 'snyk_vuln_id', 'cvss_scores', 'snyk_cve_ids', 'snyk_cvss_v3',
+    'snyk_cwes', 'severity', 'title', 'snyk_url')
+# _get_vuln_for_registered_user
+_REGISTERED_VULNERABILITY_PROPERTIES = _FREE_TIER_VULNERABILITY_PROPERTIES + (
+    'description', 'exploit', 'malicious', 'patch_exists', 'fixable', 'fixed_in')
+
+
+def _value_map(properties: Tuple[str]) -> str:
+    """Build valueMap() step which projects only the given properties."""
+    return 'valueMap({})'.format(', '.join("'{}'".format(prop) for prop in properties))
+
+
+def _get_epv_details_query(vulnerability_properties: Tuple[str]) -> str:
+    """Build package, version and vulnerability details query of a projection."""
     query = """
-            g.V().has('ecosystem', eco).has('name', name).
-            out('has_version').not(out('has_snyk_cve')).values('version');
+            epv = [];
+            packages.each {{
+                g.V().has('pecosystem', ecosystem).
+                has('pname', it.name).
+                has('version', it.version).as('version', 'vuln').
+                select('version').in('has_version').dedup().as('package').
+                select('package', 'version', 'vuln').
+                by({package}).
+                by({version}).
+                by(out('has_snyk_cve').{vuln}.fold()).
+                fill(epv);
+            }}
+            epv;
             """
-    query = inspect.cleandoc(query)
-    bindings = {
-        'eco': ecosystem,
-        'name': pkg.name
-    }
-    result = post_gremlin(query, bindings)
-    if result:
-        versions = result['result']['data']
-        if len(versions) == 0:
-            return None
-    else:
-        return None
-    rec_version = pkg.version
-    for ver in versions:
-        rec_version = select_latest_version(
-            ver,
-            rec_version
-        )
-    if rec_version == pkg.version:
-        return None
-    return rec_version
+    # get rid of leading white spaces
+    return inspect.cleandoc(query).format(package=_value_map(_PACKAGE_PROPERTIES),
+                                          version=_value_map(_VERSION_PROPERTIES),
+                                          vuln=_value_map(vulnerability_properties))
+
+
+def _as_int(value):
+    """Convert graph value to int like pydantic does, leave it as is if it is no number."""
+    if isinstance(value, int):
+        return value
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return value
+
+
+# conversions which validation does on graph values, applied when it is skipped.
+_GITHUB_DETAILS_COERCIONS = dict.fromkeys(
+    ('watchers', 'total_releases', 'dependent_repos', 'open_issues_count', 'forks_count',
+     'contributors', 'stargazers_count', 'dependent_projects'), _as_int)
+_GITHUB_DETAILS_COERCIONS['used_by'] = lambda used_by: [UsedByItem.construct(**item)
+                                                        for item in used_by]
+_VULNERABILITY_COERCIONS = {'cvss': float, 'severity': Severity}
+_PACKAGE_DETAILS_COERCIONS = {'ecosystem': Ecosystem}
+_MODEL_COERCIONS = {
+    GitHubDetails: _GITHUB_DETAILS_COERCIONS,
+    BasicVulnerabilityFields: _VULNERABILITY_COERCIONS,
+    PremiumVulnerabilityFields: {**_VULNERABILITY_COERCIONS, 'exploit': Exploit},
+    PackageDetailsForFreeTier: _PACKAGE_DETAILS_COERCIONS,
+    PackageDetailsForRegisteredUser: _PACKAGE_DETAILS_COERCIONS,
+}
+
+
+def _build_model(model: Type[BaseModel], validate: bool, **fields) -> BaseModel:
+    """Create model from trusted graph data, it is validated only if asked to.
+
+    Without validation only the type conversions listed in _MODEL_COERCIONS are done
+    and, as validation would, fields unknown to the model are dropped and fields are
+    kept in the declared order.
+    """
+    if validate:
+        return model(**fields)
+    ordered = {name: fields[name] if name in fields else copy.deepcopy(field.default)
+               for name, field in model.__fields__.items()}
+    for name, coerce in _MODEL_COERCIONS.get(model, {}).items():
+        if ordered[name] is not None:
+            ordered[name] = coerce(ordered[name])
+    instance = model.construct(_fields_set=set(fields).intersection(ordered), **ordered)
+    # construct() of older pydantic versions puts fields having a default first.
+    object.__setattr__(instance, '__dict__', ordered)
+    return instance
 
 
 def _is_private_vulnerability(vulnerability_node):
@@ -93,7 +240,7 @@ def _get_vuln_for_registered_user(vuln_node: Dict[str, str]):
     return {**info_free_tier, **info_for_registered_user}
 
 
-def _get_github_details(package_node) -> GitHubDetails:
+def _get_github_details(package_node, validate: bool = True) -> GitHubDetails:
     """Get fields associated with Github statistics of a package node."""
     date = format_date(package_node.get("gh_refreshed_on", ["N/A"])[0])
     github_details = {
@@ -138,15 +285,15 @@ def _get_github_details(package_node) -> GitHubDetails:
         }
         used_by_list.append(used_by_dict)
     github_details['used_by'] = used_by_list
-    return GitHubDetails(**github_details)
+    return _build_model(GitHubDetails, validate, **github_details)
 
 
-def _get_pkg_from_graph_version_node(version_node) -> Tuple[Ecosystem, Package]:
-    """Create Package instance from version_node."""
+def _get_pkg_from_graph_version_node(version_node) -> Tuple[Ecosystem, PackageKey]:
+    """Create PackageKey instance from version_node."""
     name = version_node.get("pname", [""])[0]
     version = version_node.get("version", [""])[0]
     ecosystem = version_node.get("pecosystem", [""])[0]
-    return ecosystem, Package(name=name, version=version)
+    return ecosystem, PackageKey(name, version)
 
 
 # (fixme): This should be moved to v2/recommender
@@ -163,15 +310,31 @@ def _get_packages_in_batch(dependencies: Tuple[Package], size: int) -> Tuple[Pac
         yield dependencies[i:i + size]
 
 
+def _fetch_gremlin_batch(query: str, bindings: Dict,
+                         stream: bool) -> Iterable[Dict[str, object]]:
+    """Fetch records of a single gremlin batch.
+
+    A streamed batch is only read up to its first record, the remaining ones are
+    parsed one by one while the caller iterates, the raw response is never buffered.
+    """
+    if stream:
+        records = post_gremlin_stream(query, bindings)
+        for first in records:
+            return itertools.chain((first,), records)
+        return ()
+    result = post_gremlin(query, bindings)
+    return result['result']['data'] if result else []
+
+
 def _has_vulnerability(pkg: PackageDetails) -> bool:
     return pkg and (pkg.public_vulnerabilities or pkg.private_vulnerabilities)
 
 
 # (fixme) link to snyk package should be identified during ingestion.
-def _get_snyk_package_link(ecosystem, package):
-    ecosystem = Settings().snyk_ecosystem_map.get(ecosystem, ecosystem)
-    return Settings().snyk_package_url_format.format(ecosystem=ecosystem,
-                                                     package=package)
+def _get_snyk_package_link(ecosystem, package, settings: Settings):
+    ecosystem = settings.snyk_ecosystem_map.get(ecosystem, ecosystem)
+    return settings.snyk_package_url_format.format(ecosystem=ecosystem,
+                                                   package=package)
 
 
 def initiate_unknown_package_ingestion(output: StackAggregatorResult):
@@ -189,6 +352,12 @@ def initiate_unknown_package_ingestion(output: StackAggregatorResult):
 class Aggregator(ABC):
     """Base class which contains common functionality related to aggregation."""
 
+    # name and query of the graph properties projection needed by the response
+    _projection: str = None
+    _epv_details_query: str = None
+    # projections of the snapshots whose records hold every property of this one
+    _snapshot_projections: Tuple[str] = ()
+
     def __init__(self,
                  request: StackAggregatorRequest = None,
                  normalized_packages: NormalizedPackages = None):
@@ -197,15 +366,33 @@ class Aggregator(ABC):
         self._normalized_packages = normalized_packages
         self._normalized_package_details = None
         self._result = None
+        # read once, it is needed for every package.
+        self._settings = Settings()
 
     def get_package_details_from_graph(self) -> Dict[Package, PackageDetails]:
         """Get dependency data from graph."""
-        graph_response = self._get_package_details_with_vulnerabilities()
-        package_details: List[Tuple[Package, PackageDetails]] = []
-        for pkg in graph_response:
-            package_details.append(self._get_package_details(pkg))
-        # covert list of (pkg, package_details) into map
-        return dict(package_details)
+        # details are built while records arrive, batch after batch.
+        package_details = dict(self._get_package_details(record) for record in
+                               self._get_package_details_with_vulnerabilities())
+        self._set_recommended_versions(package_details)
+        return package_details
+
+    def _set_recommended_versions(self, package_details: Dict[Package, PackageDetails]):
+        """Fill recommended_version of vulnerable packages not having it in graph."""
+        fallbacks = [pkg for pkg, detail in package_details.items()
+                     if _has_vulnerability(detail) and not detail.recommended_version]
+        if not fallbacks:
+            return
+        logger.warning('Fallback to graph query to retrive latest version for '
+                       '%d %s packages', len(fallbacks), self._normalized_packages.ecosystem)
+        recommended_versions = get_recommended_versions(self._normalized_packages.ecosystem,
+                                                        fallbacks)
+        for pkg in fallbacks:
+            package_details[pkg].recommended_version = recommended_versions.get(pkg)
+
+    def _create_model(self, model: Type[BaseModel], **fields) -> BaseModel:
+        """Create model from graph data, validated only if validate_graph_models is set."""
+        return _build_model(model, self._settings.validate_graph_models, **fields)
 
     def _get_vulnerabilities(self, vulnerability_nodes):
         """Get list of vulnerabilities associated with a package."""
@@ -223,15 +410,12 @@ class Aggregator(ABC):
         pkg_node = component.get("package", {})
         version_node = component.get("version", {})
         ecosystem, pkg = _get_pkg_from_graph_version_node(version_node)
-        github_details = _get_github_details(pkg_node)
+        github_details = _get_github_details(pkg_node, self._settings.validate_graph_models)
         public_vulns, private_vulns = self._get_vulnerabilities(component.get("vuln", {}))
         recommended_latest_version = None
         if public_vulns or private_vulns:
-            recommended_latest_version = pkg_node.get("latest_non_cve_version", [""])[0]
-            if not recommended_latest_version:
-                logger.warning('Fallback to graph query to retrive latest version for '
-                               '%s %s %s', ecosystem, pkg.name, pkg.version)
-                recommended_latest_version = get_recommended_version(ecosystem, pkg)
+            # missing ones are resolved for the whole stack in _set_recommended_versions.
+            recommended_latest_version = pkg_node.get("latest_non_cve_version", [""])[0] or None
 
         licenses = version_node.get("declared_licenses", [])
 
@@ -241,61 +425,135 @@ class Aggregator(ABC):
             pkg_node.get("latest_version", [""])[0],
             pkg.name
         )
-        return pkg, self.create_package_details(**pkg.dict(), ecosystem=ecosystem,
+        return pkg, self.create_package_details(name=pkg.name, version=pkg.version,
+                                                ecosystem=ecosystem,
                                                 latest_version=latest_version,
                                                 github=github_details, licenses=licenses,
                                                 # (fixme) this is incorrect
                                                 url=_get_snyk_package_link(ecosystem,
-                                                                           pkg.name),
+                                                                           pkg.name,
+                                                                           self._settings),
                                                 private_vulnerabilities=private_vulns,
                                                 public_vulnerabilities=public_vulns,
                                                 recommended_version=recommended_latest_version)
 
-    def _get_package_details_with_vulnerabilities(self) -> List[Dict[str, object]]:
-        """Get package data from graph along with vulnerability."""
+    def _get_package_details_with_vulnerabilities(self) -> Iterator[Dict[str, object]]:
+        """Yield package data along with vulnerability, from cache or graph."""
+        ecosystem = self._normalized_packages.ecosystem
+        hits = 0
+        snapshot_hits = 0
+        missing = {}
+        known_unknowns = 0
+        snapshot = get_epv_snapshot()
+        if snapshot is not None and snapshot.projection not in self._snapshot_projections:
+            # records of a narrower projection lack properties of this response.
+            snapshot = None
+        for pkg in self._normalized_packages.all_dependencies:
+            key = (ecosystem, pkg.name, pkg.version)
+            # records differ per projection, so they are cached per projection.
+            record = _epv_cache.get((self._projection,) + key)
+            if record is None and snapshot is not None:
+                record = snapshot.get(*key)
+                snapshot_hits += record is not None
+            if record is not None:
+                hits += 1
+                yield record
+            elif _unknown_epv_cache.get(key):
+                # recently found missing in graph, skip until ingestion completes.
+                known_unknowns += 1
+            else:
+                missing[key] = pkg
+        # EPVs already being fetched by concurrent requests are waited for.
+        owned, waiting = _epv_flights.claim([(self._projection,) + key for key in missing])
+        logger.info('epv cache hits %d snapshot hits %d known unknowns %d misses %d '
+                    'coalesced %d', hits - snapshot_hits, snapshot_hits, known_unknowns,
+                    len(owned), len(waiting))
+
+        pending = set(owned)
+        try:
+            for record in self._get_package_details_from_graph(
+                    tuple(missing[key[1:]] for key in owned)):
+                version_node = record.get('version', {})
+                key = (self._projection, ecosystem, version_node.get('pname', [''])[0],
+                       version_node.get('version', [''])[0])
+                _epv_cache.put(key, record)
+                if key in pending:
+                    pending.discard(key)
+                    _epv_flights.resolve(key, record)
+                yield record
+        except BaseException as e:
+            if not isinstance(e, Exception):
+                e = GremlinExeception('epv lookup was abandoned')
+            for key in pending:
+                _epv_flights.resolve(key, exception=e)
+            raise
+
+        for key in pending:
+            _unknown_epv_cache.put(key[1:], True)
+            _epv_flights.resolve(key, None)
+
+        for future in waiting.values():
+            record = future.result()
+            if record is not None:
+                yield record
+
+    def _get_package_details_from_graph(self,
+                                        packages: Tuple[PackageKey]) -> Iterator[Dict[str, object]]:
+        """Yield package data from graph along with vulnerability, batch by batch."""
         time_start = time.time()
-        pkgs_with_vuln = {
-            "result": {
-                "data": []
+        query = self._epv_details_query
+        settings = Settings()
+        ecosystem = self._normalized_packages.ecosystem
+
+        def fetch(pkgs: Tuple[PackageKey]) -> Iterable[Dict[str, object]]:
+            bindings = {
+                'ecosystem': ecosystem,
+                # convert Tuple[PackageKey] into List[{name:.., version:..}]
+                'packages': [{'name': pkg.name, 'version': pkg.version} for pkg in pkgs]
             }
-        }
-        query = """
-                epv = [];
-                packages.each {
-                    g.V().has('pecosystem', ecosystem).
-                    has('pname', it.name).
-                    has('version', it.version).as('version', 'vuln').
-                    select('version').in('has_version').dedup().as('package').
-                    select('package', 'version', 'vuln').
-                    by(valueMap()).
-                    by(valueMap()).
-                    by(out('has_snyk_cve').valueMap().fold()).
-                    fill(epv);
-                }
-                epv;
-                """
-        # get rid of leading white spaces
-        query = inspect.cleandoc(query)
-        bindings = {
-            'ecosystem': self._normalized_packages.ecosystem,
-            'packages': []
-        }
-        # call gremlin in batches of GREMLIN_QUERY_SIZE
-        for pkgs in _get_packages_in_batch(self._normalized_packages.all_dependencies,
-                                           GREMLIN_QUERY_SIZE):
-            # convert Tuple[Package] into List[{name:.., version:..}]
-            bindings['packages'] = [pkg.dict(exclude={'dependencies'}) for pkg in pkgs]
-            result = post_gremlin(query, bindings)
-            if result:
-                pkgs_with_vuln['result']['data'] += result['result']['data']
+            return _fetch_gremlin_batch(query, bindings, settings.gremlin_stream_responses)
+
+        # call gremlin in batches sized by the sizer of this query, at most
+        # gremlin_batch_concurrency_per_request of them in flight at once. The
+        # oldest batch is consumed before the next one is submitted, so records
+        # are yielded in submission order while the others are running.
+        sizer = get_batch_sizer('epv_details', ecosystem, GREMLIN_QUERY_SIZE)
+        window = deque()
+        counts = {'batches': 0, 'failed': 0, 'records': 0}
+
+        def consume(future) -> Iterator[Dict[str, object]]:
+            try:
+                # records of streamed batches are parsed here, as they are consumed.
+                for record in future.result():
+                    counts['records'] += 1
+                    yield record
+            except GremlinExeception:
+                logger.error('gremlin batch %d failed for ecosystem %s',
+                             counts['batches'] - len(window), ecosystem)
+                counts['failed'] += 1
+
+        for pkgs in sizer.batches(packages):
+            if len(window) >= settings.gremlin_batch_concurrency_per_request:
+                yield from consume(window.popleft())
+            window.append(_gremlin_batch_executor.submit(sizer.run, fetch, pkgs))
+            counts['batches'] += 1
+        while window:
+            yield from consume(window.popleft())
 
         logger.info(
-            'get_package_details_with_vulnerabilities time: %f total_results %d',
-            time.time() - time_start, len(pkgs_with_vuln['result']['data']))
-        return pkgs_with_vuln['result']['data']
-
-    def _get_denormalized_package_details(self) -> List[PackageDetails]:
-        """Pack PackageDetails according to it's dependency graph structure."""
+            'get_package_details_from_graph time: %f total_results %d',
+            time.time() - time_start, counts['records'])
+        if counts['failed']:
+            raise GremlinExeception('{} of {} gremlin batches failed'.format(
+                counts['failed'], counts['batches']))
+
+    def _get_denormalized_package_details(
+            self, with_vulnerable_dependencies: bool = True) -> List[PackageDetails]:
+        """Pack PackageDetails according to it's dependency graph structure.
+
+        Only details of direct packages are copied to attach their dependencies, details
+        of vulnerable transitives are shared by all the directs depending on them.
+        """
         package_details = []
         for package, transitives in self._normalized_packages.dependency_graph.items():
             package_detail = self._normalized_package_details.get(package)
@@ -303,26 +561,29 @@ class Aggregator(ABC):
                 package_detail = package_detail.copy()
             else:
                 continue  # pragma: no cover
-            transitive_details = []
-            for transitive in transitives:
-                transitive_detail = self._normalized_package_details.get(transitive)
-                if _has_vulnerability(transitive_detail):
-                    transitive_detail = transitive_detail.copy()
-                else:
-                    continue  # pragma: no cover
-                transitive_details.append(transitive_detail)
-            package_detail.dependencies = list(transitives)
-            package_detail.vulnerable_dependencies = transitive_details
+            package_detail.dependencies = [pkg.to_package() for pkg in transitives]
+            if with_vulnerable_dependencies:
+                package_detail.vulnerable_dependencies = self._get_vulnerable_details(
+                    transitives)
             package_details.append(package_detail)
         return package_details
 
+    def _get_vulnerable_details(self, packages) -> List[PackageDetails]:
+        """Get shared details of the vulnerable ones of packages."""
+        vulnerable_details = []
+        for package in packages:
+            package_detail = self._normalized_package_details.get(package)
+            if _has_vulnerability(package_detail):
+                vulnerable_details.append(package_detail)
+        return vulnerable_details
+
     def _get_unknown_packages(self) -> List[Package]:
         """Get list of unknown packages from the normalized_package_details."""
         all_dependencies = set(self._normalized_packages.all_dependencies)
         analyzed_dependencies = set(self._normalized_package_details.keys())
         unknown_dependencies = list()
         for pkg in all_dependencies.difference(analyzed_dependencies):
-            unknown_dependencies.append(pkg)
+            unknown_dependencies.append(pkg.to_package())
         return unknown_dependencies
 
     @abstractmethod
@@ -354,11 +615,19 @@ class Aggregator(ABC):
                                   StackAggregatorResultForRegisteredUser]:
         """Aggregate stack data."""
         # denormalize package details according to request.dependencies relations
-        package_details = self._get_denormalized_package_details()
+        normalized = self._request.normalized_response
+        package_details = self._get_denormalized_package_details(not normalized)
+        vulnerable_dependency_details = None
+        if normalized:
+            # every vulnerable transitive once, referenced from dependencies by name and version.
+            transitives = sorted(self._normalized_packages.transitive_dependencies,
+                                 key=lambda pkg: (pkg.name, pkg.version))
+            vulnerable_dependency_details = self._get_vulnerable_details(transitives)
         unknown_dependencies = self._get_unknown_packages()
         license_analysis = get_license_analysis_for_stack(self._normalized_package_details)
         return self.create_result(**self._request.dict(exclude={'packages'}),
                                   analyzed_dependencies=package_details,
+                                  vulnerable_dependency_details=vulnerable_dependency_details,
                                   unknown_dependencies=unknown_dependencies,
                                   license_analysis=license_analysis)
 
@@ -366,6 +635,10 @@ class Aggregator(ABC):
 class Freetier(Aggregator):
     """Create Freetier response."""
 
+    _projection = 'freetier'
+    _epv_details_query = _get_epv_details_query(_FREE_TIER_VULNERABILITY_PROPERTIES)
+    _snapshot_projections = ('freetier', 'registered')
+
     def __init__(self, request: StackAggregatorRequest = None,
                  normalized_packages: NormalizedPackages = None):
         """Create Freetier instance."""
@@ -373,11 +646,11 @@ class Freetier(Aggregator):
 
     def create_package_details(self, **kwargs) -> PackageDetailsForFreeTier:
         """Get PackageDetailsForFreeTier."""
-        return PackageDetailsForFreeTier(**kwargs)
+        return self._create_model(PackageDetailsForFreeTier, **kwargs)
 
     def create_vulnerability(self, vuln_node: Dict[str, str]) -> BasicVulnerabilityFields:
         """Get fields associated with free tier users."""
-        return BasicVulnerabilityFields(**_get_vuln_for_free_tier(vuln_node))
+        return self._create_model(BasicVulnerabilityFields, **_get_vuln_for_free_tier(vuln_node))
 
     def create_result(self, **kwargs) -> StackAggregatorResultForFreeTier:
         """Get StackAggregatorResultForFreeTier."""
@@ -388,6 +661,10 @@ class Freetier(Aggregator):
 class Registered(Aggregator):
     """Create registered user response."""
 
+    _projection = 'registered'
+    _epv_details_query = _get_epv_details_query(_REGISTERED_VULNERABILITY_PROPERTIES)
+    _snapshot_projections = ('registered',)
+
     def __init__(self, request: StackAggregatorRequest = None,
                  normalized_packages: NormalizedPackages = None):
         """Create Registered instance."""
@@ -395,11 +672,12 @@ class Registered(Aggregator):
 
     def create_package_details(self, **kwargs) -> PackageDetailsForRegisteredUser:
         """Create PackageDetailsForRegisteredUser."""
-        return PackageDetailsForRegisteredUser(**kwargs)
+        return self._create_model(PackageDetailsForRegisteredUser, **kwargs)
 
     def create_vulnerability(self, vuln_node: Dict[str, str]) -> PremiumVulnerabilityFields:
         """Get fields associated with registered users."""
-        return PremiumVulnerabilityFields(**_get_vuln_for_registered_user(vuln_node))
+        return self._create_model(PremiumVulnerabilityFields,
+                                  **_get_vuln_for_registered_user(vuln_node))
 
     def create_result(self, **kwargs) -> StackAggregatorResultForRegisteredUser:
         """Get StackAggregatorResultForRegisteredUser."""
@@ -429,11 +707,16 @@ class StackAggregator:
         # (fixme): Use timestamp instead of str representation.
         started_at = datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S.%f")
         output = StackAggregator.process_request(request)
-        output_dict = output.dict()
+        # vulnerable_dependency_details is only set, and only listed, in normalized responses.
+        output_dict = output.dict(exclude=({'vulnerable_dependency_details'}
+                                           if output.vulnerable_dependency_details is None
+                                           else None))
         ended_at = datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S.%f")
         # (fixme): Remove _ to make it as part of pydantic model.
         output_dict["_audit"] = Audit(started_at=started_at, ended_at=ended_at,
                                       version="v2").dict()
+        # encoded once, for both the database and the HTTP response.
+        output_dict = EncodedJSON(output_dict)
         if persist:
             persist_data_in_db(external_request_id=output.external_request_id,
                                task_result=output_dict, worker='stack_aggregator_v2',
@@ -0,0 +1,135 @@
+"""In-process index of the versions of a package, sorted by their parsed form.
+
+Answers "latest version without CVE" and "lowest fixed version above the current
+one" with bisect lookups instead of a graph round trip per package. Indexes are
+loaded lazily from graph and refreshed once their TTL expires.
+"""
+
+import inspect
+import logging
+
+from bisect import bisect_right
+from typing import Dict, Iterable, List, Optional, Tuple
+from src.cache import LRUCache
+from src.settings import Settings
+from src.utils import post_gremlin, version_sort_key, GREMLIN_QUERY_SIZE
+
+logger = logging.getLogger(__file__)
+
+# every version of the given packages with a flag telling if it has a cve.
+_VERSION_INDEX_QUERY = inspect.cleandoc("""
+    g.V().has('ecosystem', eco).has('name', within(names)).
+    group().by('name').
+    by(out('has_version').
+       project('version', 'cve').
+       by('version').
+       by(coalesce(out(cve_edge).limit(1).constant(true), constant(false))).
+       fold());
+    """)
+_zero_version_key = version_sort_key('')
+# indexes keyed by (cve_edge, ecosystem, name), sized by entry count.
+_version_indexes = LRUCache(max_bytes=Settings().version_index_max_entries,
+                            ttl=Settings().version_index_ttl)
+
+
+class VersionIndex:
+    """Versions of a package sorted ascending, with a bitmap of vulnerable ones.
+
+    Bit i of the bitmap is set when versions[i] has a CVE. Versions that can't
+    be parsed are left out, of equal versions the first one is kept.
+    """
+
+    __slots__ = ('versions', '_keys', '_safe')
+
+    def __init__(self, versions: Iterable[Tuple[str, bool]]):
+        """Build index from (version, has_cve) pairs."""
+        cve_by_version = {}
+        for version, has_cve in versions:
+            cve_by_version[version] = cve_by_version.get(version, False) or bool(has_cve)
+        keyed = []
+        for version in cve_by_version:
+            key = version_sort_key(version)
+            if key != _zero_version_key:
+                keyed.append((key, version))
+        keyed.sort(key=lambda pair: pair[0])
+        self.versions: List[str] = []
+        self._keys = []
+        cve_bits = 0
+        for key, version in keyed:
+            if self._keys and self._keys[-1] == key:
+                continue
+            if cve_by_version[version]:
+                cve_bits |= 1 << len(self.versions)
+            self._keys.append(key)
+            self.versions.append(version)
+        # bitmap of versions without CVE
+        self._safe = ~cve_bits & ((1 << len(self.versions)) - 1)
+
+    def __len__(self):
+        """Return number of indexed versions."""
+        return len(self.versions)
+
+    def has_cve(self, version: str) -> Optional[bool]:
+        """Return whether version has a CVE, None if it is not indexed."""
+        key = version_sort_key(version)
+        pos = bisect_right(self._keys, key) - 1
+        if pos < 0 or self._keys[pos] != key:
+            return None
+        return not self._safe >> pos & 1
+
+    def latest_non_cve_version(self) -> Optional[str]:
+        """Return highest version without CVE."""
+        if not self._safe:
+            return None
+        return self.versions[self._safe.bit_length() - 1]
+
+    def recommended_version(self, version: str) -> Optional[str]:
+        """Return highest version without CVE if it is above the given version."""
+        latest = self.latest_non_cve_version()
+        if latest is None or version_sort_key(latest) <= version_sort_key(version):
+            return None
+        return latest
+
+    def lowest_fixed_version(self, version: str) -> Optional[str]:
+        """Return lowest version without CVE above the given version."""
+        pos = bisect_right(self._keys, version_sort_key(version))
+        above = self._safe >> pos
+        if not above:
+            return None
+        return self.versions[pos + (above & -above).bit_length() - 1]
+
+
+def get_version_indexes(ecosystem: str, names: Iterable[str],
+                        cve_edge: str) -> Dict[str, VersionIndex]:
+    """Return version index of every given package, loading the missing ones from graph.
+
+    cve_edge is the label of the edges linking a vulnerable version to its CVEs.
+    Packages unknown to graph get an empty index.
+    """
+    indexes = {}
+    missing = []
+    for name in sorted(set(names)):
+        index = _version_indexes.get((cve_edge, ecosystem, name))
+        if index is None:
+            missing.append(name)
+        else:
+            indexes[name] = index
+    for i in range(0, len(missing), GREMLIN_QUERY_SIZE):
+        batch = missing[i:i + GREMLIN_QUERY_SIZE]
+        bindings = {
+            'eco': ecosystem,
+            'names': batch,
+            'cve_edge': cve_edge
+        }
+        result = post_gremlin(_VERSION_INDEX_QUERY, bindings)
+        if not result:
+            continue
+        versions_by_name = {}
+        for group in result['result']['data']:
+            versions_by_name.update(group)
+        for name in batch:
+            index = VersionIndex((record['version'], record['cve'])
+                                 for record in versions_by_name.get(name, []))
+            _version_indexes.put((cve_edge, ecosystem, name), index)
+            indexes[name] = index
+    return indexes
@@ -0,0 +1,79 @@
+"""Tests for the 'batch_sizer' module."""
+import concurrent.futures
+import os
+import requests
+from unittest import mock
+from pytest import raises
+from src.batch_sizer import BatchSizer, get_batch_sizer, is_timeout_error
+from src.utils import GremlinExeception
+
+
+def test_batch_sizer_adapts_to_latency():
+    """Test batch size grows under target latency and shrinks above it."""
+    sizer = BatchSizer(8, min_size=2, max_size=12, target_latency=1.0, adaptive=True)
+    assert [len(b) for b in sizer.batches(list(range(20)))] == [8, 8, 4]
+    sizer.observe(8, 0.1)
+    assert sizer.size == 10
+    # partial batches do not grow the size
+    sizer.observe(4, 0.1)
+    assert sizer.size == 10
+    sizer.observe(10, 0.1)
+    assert sizer.size == 12
+    sizer.observe(12, 3.0)
+    assert sizer.size == 4
+    sizer.timed_out(4)
+    assert sizer.size == 2
+    sizer.timed_out(2)
+    assert sizer.size == 2
+
+    fixed = BatchSizer(8)
+    fixed.observe(8, 0.1)
+    fixed.timed_out(8)
+    assert fixed.size == 8
+
+
+def test_batch_sizer_splits_timed_out_batch():
+    """Test timed out batch is retried in halves, other errors are raised."""
+    def fetch(batch):
+        if len(batch) > 2:
+            raise GremlinExeception from requests.exceptions.ReadTimeout()
+        return list(batch)
+
+    sizer = BatchSizer(8, min_size=1, max_size=8, target_latency=60.0, adaptive=True)
+    assert list(sizer.run(fetch, list(range(5)))) == list(range(5))
+    assert sizer.size < 4
+
+    with raises(GremlinExeception):
+        sizer.run(mock.Mock(side_effect=GremlinExeception('mocked')), [1, 2])
+
+
+def test_is_timeout_error():
+    """Test timeouts are recognized through the exceptions they caused."""
+    response = requests.Response()
+    response.status_code = 504
+    assert is_timeout_error(requests.exceptions.HTTPError(response=response))
+    try:
+        raise GremlinExeception from concurrent.futures.TimeoutError()
+    except GremlinExeception as e:
+        assert is_timeout_error(e)
+    response.status_code = 500
+    assert not is_timeout_error(requests.exceptions.HTTPError(response=response))
+    response._content = (b'{"message": "A timeout occurred during traversal evaluation of '
+                         b'[RequestMessage{...}] - consider increasing the limit given to '
+                         b'evaluationTimeout"}')
+    try:
+        raise GremlinExeception from requests.exceptions.HTTPError(response=response)
+    except GremlinExeception as e:
+        assert is_timeout_error(e)
+    assert not is_timeout_error(GremlinExeception('mocked'))
+
+
+def test_get_batch_sizer():
+    """Test sizers are shared per query and ecosystem only when adaptive."""
+    assert get_batch_sizer('q', 'maven', 10) is not get_batch_sizer('q', 'maven', 10)
+    with mock.patch.dict(os.environ, {'GREMLIN_ADAPTIVE_BATCHING': 'true'}), \
+            mock.patch.dict('src.batch_sizer._batch_sizers', clear=True):
+        sizer = get_batch_sizer('q', 'maven', 10)
+        assert sizer is get_batch_sizer('q', 'maven', 10)
+        assert sizer is not get_batch_sizer('q', 'npm', 10)
+        assert sizer.size == 10
@@ -0,0 +1,100 @@
+"""Tests for the cache module."""
+
+from unittest import mock
+
+from pytest import raises
+
+from src.cache import LRUCache, SingleFlight
+
+
+def test_get_put():
+    """Test basic get and put."""
+    cache = LRUCache(max_bytes=1024, ttl=60)
+    assert cache.get('foo') is None
+    assert cache.get('foo', 'bar') == 'bar'
+    cache.put('foo', {'a': 1})
+    assert cache.get('foo') == {'a': 1}
+    assert len(cache) == 1
+    stats = cache.stats()
+    assert stats['hits'] == 1
+    assert stats['misses'] == 2
+    assert stats['bytes'] == 1
+
+
+def test_ttl_expiry():
+    """Test entries expire after ttl."""
+    cache = LRUCache(max_bytes=1024, ttl=10)
+    with mock.patch('src.cache.time.monotonic', return_value=100.0):
+        cache.put('foo', 1)
+        cache.put('bar', 2, ttl=100)
+    with mock.patch('src.cache.time.monotonic', return_value=109.0):
+        assert cache.get('foo') == 1
+    with mock.patch('src.cache.time.monotonic', return_value=110.0):
+        assert cache.get('foo') is None
+        assert cache.get('bar') == 2
+    assert cache.stats()['expirations'] == 1
+    assert len(cache) == 1
+
+
+def test_lru_eviction_by_bytes():
+    """Test least recently used entries are evicted beyond the byte budget."""
+    cache = LRUCache(max_bytes=3, ttl=60, sizeof=lambda _: 1)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    cache.put('c', 3)
+    # touch 'a' so that 'b' becomes the least recently used
+    assert cache.get('a') == 1
+    cache.put('d', 4)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+    assert cache.get('d') == 4
+    assert cache.stats()['evictions'] == 1
+    assert cache.stats()['bytes'] == 3
+
+
+def test_oversized_value_is_not_cached():
+    """Test values larger than the whole budget are skipped."""
+    cache = LRUCache(max_bytes=2, ttl=60, sizeof=len)
+    cache.put('foo', 'too large')
+    assert cache.get('foo') is None
+    assert cache.stats()['bytes'] == 0
+
+
+def test_pop_and_clear():
+    """Test pop and clear."""
+    cache = LRUCache(max_bytes=1024, ttl=60)
+    cache.put('foo', 1)
+    cache.put('foo', 2)
+    assert cache.stats()['entries'] == 1
+    assert cache.pop('foo') == 2
+    assert cache.pop('foo') is None
+    cache.put('bar', 1)
+    cache.clear()
+    assert len(cache) == 0
+    assert cache.stats() == {'hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0,
+                             'entries': 0, 'bytes': 0, 'max_bytes': 1024}
+
+
+def test_single_flight():
+    """Test concurrent claims of a key wait for the leader's result."""
+    flights = SingleFlight()
+    owned, waiting = flights.claim(['a', 'b'])
+    assert owned == ['a', 'b'] and waiting == {}
+    owned, waiting = flights.claim(['b', 'c'])
+    assert owned == ['c'] and list(waiting) == ['b']
+    assert not waiting['b'].done()
+
+    flights.resolve('b', 2)
+    assert waiting['b'].result() == 2
+    flights.resolve('a', exception=ValueError('mocked'))
+    flights.resolve('c')
+    assert flights.stats() == {'leaders': 3, 'coalesced': 1, 'in_flight': 0}
+
+    # resolved keys are fetched again by the next caller
+    owned, waiting = flights.claim(['a'])
+    assert owned == ['a']
+    _, waiting = flights.claim(['a'])
+    flights.resolve('a', exception=ValueError('mocked'))
+    with raises(ValueError):
+        waiting['a'].result()
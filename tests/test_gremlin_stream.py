@@ -0,0 +1,61 @@
+"""Tests for the 'gremlin_stream' module."""
+import concurrent.futures
+import json
+import requests
+from unittest import mock
+from pytest import raises
+from src.gremlin_stream import iter_gremlin_data, post_gremlin_stream
+from src.utils import GremlinExeception
+
+
+def test_iter_gremlin_data():
+    """Test records are parsed incrementally regardless of chunk boundaries."""
+    body = {
+        'requestId': 'abc',
+        'status': {'message': '', 'code': 200, 'attributes': {'data': [1]}},
+        'result': {
+            'data': [{'version': {'pname': ['caf\u00e9'], 'count': [12345]}}, 1.5, None,
+                     [], {}, 'x'],
+            'meta': {}
+        }
+    }
+    raw = json.dumps(body, ensure_ascii=False).encode('utf-8')
+    for size in (1, 2, 7, len(raw)):
+        chunks = (raw[i:i + size] for i in range(0, len(raw), size))
+        assert list(iter_gremlin_data(chunks)) == body['result']['data']
+    assert list(iter_gremlin_data([b'{"result": {"data": []}}'])) == []
+    with raises(ValueError):
+        list(iter_gremlin_data([b'{"result": {"data": [1, ']))
+
+
+@mock.patch('requests.Session.post')
+def test_post_gremlin_stream(_mock_post):
+    """Test streamed gremlin response and its failure."""
+    response = _mock_post.return_value.__enter__.return_value
+    response.iter_content.return_value = [b'{"result": {"da', b'ta": [1, 2]}}']
+    assert list(post_gremlin_stream('query', {'val': 1})) == [1, 2]
+    kwargs = _mock_post.call_args[1]
+    assert kwargs['stream']
+    assert kwargs['json'] == {'gremlin': 'query', 'bindings': {'val': 1}}
+
+    response.raise_for_status.side_effect = requests.exceptions.HTTPError('500')
+    with raises(GremlinExeception):
+        list(post_gremlin_stream('query'))
+
+
+@mock.patch('requests.Session.post')
+@mock.patch('src.gremlin_stream.get_gremlin_ws_client')
+def test_post_gremlin_stream_websocket(_mock_client, _mock_post):
+    """Test websocket stream falls back to REST only if it can't connect."""
+    submit = _mock_client.return_value.submitAsync
+    response = _mock_post.return_value.__enter__.return_value
+    response.iter_content.return_value = [b'{"result": {"data": [1, 2]}}']
+    with mock.patch.dict('src.gremlin_transport._gremlin_ws', {'timeout': 5}):
+        submit.side_effect = concurrent.futures.TimeoutError()
+        with raises(GremlinExeception):
+            list(post_gremlin_stream('query'))
+        _mock_post.assert_not_called()
+
+        submit.side_effect = ConnectionRefusedError()
+        assert list(post_gremlin_stream('query')) == [1, 2]
+        _mock_post.assert_called_once()
@@ -0,0 +1,84 @@
+"""Tests for the 'gremlin_transport' module."""
+import concurrent.futures
+import os
+import queue
+from unittest import mock
+from pytest import raises
+from src.gremlin_transport import (get_gremlin_ws_client, is_ws_connection_error, iter_gremlin_ws,
+                                   _gremlin_ws)
+from src.utils import post_gremlin, GremlinExeception
+
+
+def test_get_gremlin_ws_client():
+    """Test websocket transport is off by default and needs gremlinpython."""
+    _gremlin_ws.clear()
+    assert get_gremlin_ws_client() is None
+    _gremlin_ws.clear()
+    with mock.patch.dict(os.environ, {'GREMLIN_TRANSPORT': 'websocket'}), \
+            mock.patch('src.gremlin_transport.GremlinClient', None):
+        assert get_gremlin_ws_client() is None
+    _gremlin_ws.clear()
+
+
+@mock.patch('requests.Session.post')
+@mock.patch('src.utils.get_gremlin_ws_client')
+def test_post_gremlin_websocket(_mock_client, _mock_post):
+    """Test gremlin queries go over websocket and fall back to REST if it can't connect."""
+    client = _mock_client.return_value
+    client.submit.return_value.all.return_value.result.return_value = [{'a': 1}]
+    with mock.patch.dict('src.gremlin_transport._gremlin_ws', {'timeout': 5}):
+        assert post_gremlin('query', {'val': 1}) == {'result': {'data': [{'a': 1}]}}
+        client.submit.assert_called_once_with('query', {'val': 1})
+        _mock_post.assert_not_called()
+
+        for error in (concurrent.futures.TimeoutError(), RuntimeError('server error')):
+            client.submit.side_effect = error
+            with raises(GremlinExeception) as exc_info:
+                post_gremlin('query', {'val': 1})
+            assert exc_info.value.__cause__ is error
+            _mock_post.assert_not_called()
+
+        client.submit.side_effect = ConnectionRefusedError()
+        post_gremlin('query', {'val': 1})
+        _mock_post.assert_called_once()
+
+
+def test_is_ws_connection_error():
+    """Test only connection errors are retried over REST."""
+    assert is_ws_connection_error(ConnectionRefusedError())
+    assert is_ws_connection_error(OSError('unreachable'))
+    assert not is_ws_connection_error(concurrent.futures.TimeoutError())
+    assert not is_ws_connection_error(RuntimeError('server error'))
+
+
+def _result_set(*chunks):
+    """Create result set with the given chunks queued on its stream."""
+    result_set = mock.Mock(stream=queue.Queue(), done=concurrent.futures.Future())
+    for chunk in chunks:
+        result_set.stream.put(chunk)
+    return result_set
+
+
+def test_iter_gremlin_ws():
+    """Test records are yielded chunk by chunk, with a timeout on every chunk."""
+    client = mock.Mock()
+    with mock.patch.dict('src.gremlin_transport._gremlin_ws', {'timeout': 0.01}):
+        result_set = _result_set([1, 2], [3])
+        client.submitAsync.return_value.result.return_value = result_set
+        records = iter_gremlin_ws(client, 'query', {'val': 1})
+        assert [next(records), next(records), next(records)] == [1, 2, 3]
+        result_set.done.set_result(None)
+        assert list(records) == []
+        client.submitAsync.assert_called_once_with('query', {'val': 1})
+
+        client.submitAsync.return_value.result.return_value = _result_set([1])
+        records = iter_gremlin_ws(client, 'query')
+        assert next(records) == 1
+        with raises(concurrent.futures.TimeoutError):
+            next(records)
+
+        result_set = _result_set()
+        result_set.done.set_exception(RuntimeError('server error'))
+        client.submitAsync.return_value.result.return_value = result_set
+        with raises(RuntimeError):
+            list(iter_gremlin_ws(client, 'query'))
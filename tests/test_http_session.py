@@ -0,0 +1,32 @@
+"""Tests for the keep-alive HTTP sessions of the 'utils' module."""
+from unittest import mock
+from src.utils import get_http_session, get_http_pool_stats, UPSTREAM_GREMLIN, UPSTREAM_LICENSE
+
+
+def test_get_http_session_is_shared_per_upstream():
+    """Test sessions are reused per upstream and carry their own timeout."""
+    gremlin = get_http_session(UPSTREAM_GREMLIN)
+    assert gremlin is get_http_session(UPSTREAM_GREMLIN)
+    license_session = get_http_session(UPSTREAM_LICENSE)
+    assert license_session is not gremlin
+    assert gremlin.timeout == 120.0
+    assert license_session.timeout == 60.0
+    assert gremlin.get_adapter('http://') is gremlin.get_adapter('https://')
+
+
+@mock.patch('requests.Session.request')
+def test_http_session_default_timeout(_mock_request):
+    """Test the upstream timeout is applied unless the caller overrides it."""
+    session = get_http_session(UPSTREAM_LICENSE)
+    session.post('http://localhost:6162/api/v1/stack_license', json={})
+    assert _mock_request.call_args[1]['timeout'] == 60.0
+    session.post('http://localhost:6162/api/v1/stack_license', json={}, timeout=5)
+    assert _mock_request.call_args[1]['timeout'] == 5
+
+
+def test_get_http_pool_stats():
+    """Test connection reuse counters are reported per upstream."""
+    get_http_session(UPSTREAM_GREMLIN)
+    stats = get_http_pool_stats()
+    assert UPSTREAM_GREMLIN in stats
+    assert set(stats[UPSTREAM_GREMLIN].keys()) == {'requests', 'connections', 'reused'}
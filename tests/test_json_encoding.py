@@ -0,0 +1,40 @@
+"""Tests for the 'json_encoding' module."""
+import json
+import uuid
+from sqlalchemy.dialects import postgresql
+from unittest import mock
+from pytest import raises
+from src.json_encoding import json_dumps_bytes, EncodedJSON, encode_json
+from src.utils import persist_data_in_db
+
+
+def test_encode_json():
+    """Check encoded results are reused when they are embedded in a response."""
+    result = EncodedJSON({'uuid': uuid.UUID(int=1), 'name': 'six', 'deps': [1, 2]})
+    assert result == {'uuid': uuid.UUID(int=1), 'name': 'six', 'deps': [1, 2]}
+    assert json.loads(result.encoded) == {'uuid': str(uuid.UUID(int=1)), 'name': 'six',
+                                          'deps': [1, 2]}
+    assert encode_json(result) is result.encoded
+    response = {'aggregation': 'success', 'result': result}
+    assert json.loads(encode_json(response)) == json.loads(json_dumps_bytes(response))
+    with mock.patch('src.json_encoding.json_dumps_bytes', wraps=json_dumps_bytes) as _mock_dumps:
+        encode_json(response)
+        assert result not in [call[0][0] for call in _mock_dumps.call_args_list]
+    assert encode_json({'a': [1]}) == json_dumps_bytes({'a': [1]}) == b'{"a":[1]}'
+    for change in (lambda: result.update(name='pip'), lambda: result.pop('name'),
+                   lambda: result.__setitem__('name', 'pip'),
+                   lambda: result.__delitem__('name')):
+        with raises(TypeError):
+            change()
+    assert result['name'] == 'six'
+
+
+@mock.patch('src.utils.session')
+def test_persist_encoded_json(_mock_session):
+    """Check encoded results are written as JSON text cast to JSONB."""
+    persist_data_in_db('id', EncodedJSON({'a': 1}), 'stack_aggregator_v2')
+    statement = _mock_session.execute.call_args[0][0]
+    compiled = statement.compile(dialect=postgresql.dialect())
+    assert 'CAST(' in str(compiled)
+    assert '{"a":1}' in compiled.params.values()
+    _mock_session.commit.assert_called_once()
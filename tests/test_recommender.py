@@ -234,19 +234,29 @@ def test_get_version_information(_mock1):
     assert len(out) == 1
 
 
+@mock.patch('src.recommender.GREMLIN_QUERY_SIZE', 2)
+@mock.patch('src.recommender.post_http_request')
+def test_get_version_information_uses_bindings(_mock_post):
+    """Test packages are looked up by a bound script, in batches."""
+    _mock_post.side_effect = [{'result': {'data': [1, 2]}}, None]
+    names = ["a", "c'); g.V().drop(); ('", "b"]
+    assert GraphDB().get_version_information(names, 'maven') == [1, 2]
+    first, second = [call[1]['payload'] for call in _mock_post.call_args_list]
+    assert first['gremlin'] == second['gremlin']
+    assert 'drop' not in first['gremlin']
+    assert "has('pname', name).has('version', within(lnv))" in first['gremlin']
+    assert first['bindings'] == {'eco': 'maven', 'names': ["a", "b"]}
+    assert second['bindings'] == {'eco': 'maven', 'names': ["c'); g.V().drop(); ('"]}
+
+
 def test_get_topics():
     """Test the function get topics."""
     alt_list = GraphDB.get_topics_for_alt(graph_resp['result']['data'],
                                           insights_resp[0]['alternate_packages'])
-    comp_list = GraphDB.get_topics_for_comp(graph_resp['result']['data'],
-                                            insights_resp[0]['companion_packages'])
 
     assert alt_list is not None
     assert isinstance(alt_list, list)
 
-    assert comp_list is not None
-    assert isinstance(comp_list, list)
-
 
 def test_get_topmost_alternate():
     """Test the function get topmost alternate recommendation."""
@@ -288,6 +298,33 @@ def test_apply_license_filter(_mock1):
     assert isinstance(out, dict)
 
 
+@mock.patch('src.recommender.License.invoke_license_analysis_service')
+def test_apply_license_filter_conflicts(_mock_license):
+    """Test conflicting packages are filtered without touching the input lists."""
+    def epv(name):
+        return {'package': {'name': [name]},
+                'version': {'version': ['1.0'], 'declared_licenses': ['MIT']}}
+
+    alt = [epv('a'), epv('b')]
+    com = [epv('c'), epv('d'), epv('c')]
+    _mock_license.return_value = {
+        'status': 'Successful',
+        'license_filter': {
+            'alternate_packages': {'conflict_packages': ['b']},
+            'companion_packages': {'conflict_packages': ['c']}
+        }
+    }
+    out = License.apply_license_filter([], alt, com)
+    assert out['filtered_alt_packages_graph'] == [epv('a')]
+    assert out['filtered_list_pkg_names_alt'] == ['b']
+    assert out['filtered_comp_packages_graph'] == [epv('d')]
+    assert out['filtered_list_pkg_names_com'] == ['c', 'c']
+    assert len(alt) == 2 and len(com) == 3
+    _, score_alt, score_com = _mock_license.call_args[0]
+    assert [pkg['package'] for pkg in score_alt] == ['a', 'b']
+    assert [pkg['package'] for pkg in score_com] == ['c', 'd', 'c']
+
+
 def test_set_valid_cooccurrence_probability():
     """Test the function set_valid_cooccurrence_probability."""
     input = [{"ecosystem": "maven", "name": "io.fabric8.funktion.connector:connector-smpp",
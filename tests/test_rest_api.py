@@ -92,6 +92,20 @@ def test_liveness_endpoint(client):
     assert json_data == {}, "Empty JSON response expected"
 
 
+@mock.patch('src.rest_api.get_http_pool_stats',
+            return_value={'gremlin': {'requests': 3, 'connections': 1, 'reused': 2}})
+def test_stats_endpoint(_mock, client):
+    """Test the /api/stats endpoint."""
+    response = client.get("/api/stats")
+    assert response.status_code == 200
+    json_data = get_json_from_response(response)
+    assert json_data['pid']
+    assert json_data['http_pools']['gremlin']['reused'] == 2
+    assert 'hits' in json_data['epv_lookups']['epv_cache']
+    assert 'max_bytes' in json_data['epv_lookups']['unknown_epv_cache']
+    assert 'coalesced' in json_data['epv_lookups']['epv_flights']
+
+
 @mock.patch('src.stack_aggregator.StackAggregator.execute', return_value=response)
 def test_stack_api_endpoint(_mock, client):
     """Check the /stack_aggregator REST API endpoint."""
@@ -1,7 +1,9 @@
 """Tests for the stack_aggregator module."""
 
 from unittest import mock
+import requests
 from src import stack_aggregator
+from src.utils import GremlinExeception
 import json
 
 
@@ -54,6 +56,9 @@ def mock_dependency_response(*_args, **_kwargs):
             """Get the mock json response."""
             return self.json_data
 
+        def raise_for_status(self):
+            """Mock a successful response."""
+
     with open('tests/data/dependency_response.json') as f:
         resp = json.loads(f.read())
     return MockResponse(resp, 200)
@@ -216,6 +221,99 @@ def test_get_recommended_version(_mock1):
     assert rec_ver is None
 
 
+@mock.patch('src.stack_aggregator.GREMLIN_QUERY_SIZE', 2)
+@mock.patch('src.stack_aggregator.post_gremlin', return_value={'result': {'data': []}})
+def test_get_epv_details_uses_bindings(_mock_post):
+    """Test EPVs are sent as bindings of the same script in every batch."""
+    epvs = [('maven', 'a', '1'), ('maven', 'b', '2'), ('maven', "c'); g.V().drop(); ('", '3')]
+    assert stack_aggregator.get_epv_details(epvs) == []
+    assert _mock_post.call_count == 2
+    (first, first_bindings), (second, second_bindings) = [
+        call[0] for call in _mock_post.call_args_list]
+    assert first == second
+    assert 'maven' not in first
+    assert first_bindings['packages'] == [
+        {'ecosystem': 'maven', 'name': 'a', 'version': '1'},
+        {'ecosystem': 'maven', 'name': 'b', 'version': '2'}]
+    assert second_bindings['packages'] == [
+        {'ecosystem': 'maven', 'name': "c'); g.V().drop(); ('", 'version': '3'}]
+
+
+@mock.patch('src.stack_aggregator.GREMLIN_QUERY_SIZE', 2)
+@mock.patch('src.stack_aggregator.post_gremlin')
+def test_get_epv_details_splits_timed_out_batch(_mock_post):
+    """Test a batch timing out on the server is retried in halves, failed ones are skipped."""
+    timeout = requests.Response()
+    timeout.status_code = 500
+    timeout._content = b'{"message": "Script evaluation exceeded the configured threshold"}'
+
+    def post(_query, bindings):
+        packages = bindings['packages']
+        if len(packages) > 1:
+            raise GremlinExeception from requests.exceptions.HTTPError(response=timeout)
+        if packages[0]['name'] == 'b':
+            raise GremlinExeception('mocked')
+        return {'result': {'data': [packages[0]['name']]}}
+
+    _mock_post.side_effect = post
+    epvs = [('maven', 'a', '1'), ('maven', 'b', '2'), ('maven', 'c', '3')]
+    assert stack_aggregator.get_epv_details(epvs) == ['a', 'c']
+    assert _mock_post.call_count == 4
+
+
+def test_find_unknown_deps():
+    """Test unknown dependencies and vulnerable transitives are found by index."""
+    def record(name, version, licenses=None, cve=False):
+        rec = {'version': {'pname': [name], 'version': [version]}}
+        if licenses:
+            rec['version']['declared_licenses'] = licenses
+        if cve:
+            rec['cve'] = {'cve_id': ['CVE-1']}
+        return rec
+
+    vulnerable = record('a', '1', ['MIT'], cve=True)
+    epv_data = [vulnerable, record('a', '1', ['MIT'], cve=True), record('b', '1'),
+                record('c', '2', ['MIT'])]
+    epv_list = {'result': {'data': []}}
+    epv_list, unknown = stack_aggregator.find_unknown_deps(
+        epv_data, epv_list, [('a', '1'), ('b', '1'), ('c', '1'), ('c', '2')], [], True)
+    assert epv_list['result']['data'] == [vulnerable]
+    assert unknown == [{'name': 'b', 'version': '1'}, {'name': 'c', 'version': '1'}]
+
+    epv_list, unknown = stack_aggregator.find_unknown_deps(
+        epv_data, {'result': {'data': []}}, [('a', '1')], [])
+    assert epv_list['result']['data'] == []
+    assert unknown == []
+
+
+def test_add_transitive_details():
+    """Test CVEs are clubbed per EPV and transitives get their affected direct deps."""
+    def record(name, version, cve=None):
+        rec = {'package': {'name': [name]},
+               'version': {'pecosystem': ['maven'], 'pname': [name], 'version': [version]}}
+        if cve:
+            rec['cve'] = {'cve_id': [cve]}
+        return rec
+
+    resolved = [{'package': 'a', 'version': '1', 'deps': [{'package': 'b', 'version': '2'}]},
+                {'package': 'b', 'version': '2', 'deps': []}]
+    epv_set = stack_aggregator.create_dependency_data_set(resolved, 'maven')
+    assert epv_set['transitive'] == {('maven', 'b', '2'): {('maven', 'a', '1')}}
+    epv_list = {'result': {'data': [record('a', '1'), record('b', '2', 'CVE-1'),
+                                    record('b', '2', 'CVE-2'), record('b', '2', 'CVE-1')]}}
+    result = stack_aggregator.add_transitive_details(epv_list, epv_set)
+    assert [entry['data'][0]['version']['pname'][0] for entry in result] == ['a', 'b', 'b']
+    direct_b, transitive_b = result[1]['data'][0], result[2]['data'][0]
+    assert direct_b['cves'] == [{'cve_id': ['CVE-1']}, {'cve_id': ['CVE-2']}]
+    assert 'cve' not in direct_b
+    assert 'transitive' not in direct_b
+    assert transitive_b['transitive'] == {
+        'isTransitive': True,
+        'affected_direct_deps': [{'package': 'a', 'version': '1'}]
+    }
+    assert transitive_b['cves'] == direct_b['cves']
+
+
 if __name__ == '__main__':
     test_extract_component_details()
     test_stack_aggregator_constructor()
@@ -9,9 +9,11 @@ from src.utils import push_data, get_time_delta
 from src.utils import (
     convert_version_to_proper_semantic as cvs, GREMLIN_SERVER_URL_REST, format_date,
     version_info_tuple as vt, select_latest_version as slv,
-    get_osio_user_count, create_package_dict, is_quickstart_majority, post_http_request,
+    get_osio_user_count, get_osio_user_counts, create_package_dict, is_quickstart_majority,
+    index_insights_packages, LazyJSON, version_sort_key, select_max_version,
+    post_http_request,
     server_create_analysis, select_from_db, total_time_elapsed, post_gremlin,
-    GremlinExeception)
+    GremlinExeception, _osio_user_count_cache)
 
 METRICS_COLLECTION_URL = "http://{base_url}:{port}/api/v1/prometheus".format(
     base_url='metrics-accumulator-deepak1725-fabric8-analytics.devtools-dev.ext.devshift.net',
@@ -94,6 +96,30 @@ def test_semantic_versioning():
     assert cvs(version, package_name) == sv.Version("0.0.0")
 
 
+def test_version_sort_key():
+    """Check version keys are memoized and compare like the parsed versions."""
+    assert version_sort_key("1.5.2.RELEASE") == vt(cvs("1.5.2.RELEASE"))
+    assert version_sort_key("") == version_sort_key("[1.4)") == (0, 0, 0, ())
+    assert version_sort_key("2.10") > version_sort_key("2.9")
+    assert cvs("2.10") is cvs("2.10")
+    hits = version_sort_key.cache_info().hits
+    version_sort_key("2.10")
+    assert version_sort_key.cache_info().hits == hits + 1
+    assert cvs(["1.0"]) == sv.Version("0.0.0")
+
+
+def test_select_max_version():
+    """Check max of versions matches folding select_latest_version over them."""
+    versions = ["1.2.0", "2.10", "2.9", "2.10.0", "[1.4)", ""]
+    folded = ""
+    for ver in versions:
+        folded = slv(ver, folded)
+    assert select_max_version(versions) == folded == "2.10"
+    assert select_max_version([]) == ""
+    assert select_max_version(["", "-1", None]) == ""
+    assert select_max_version(["1.0", {"version": "2.0"}]) == ""
+
+
 def test_format_date():
     """Check the function format_date()."""
     date1 = '2019-05-21 06:44:15'
@@ -150,13 +176,80 @@ def test_get_osio_user_count(_mock_get, _mock_post):
     assert isinstance(out, int)
 
 
-@mock.patch('src.utils.get_osio_user_count', return_value=1)
-def test_create_package_dict(_mock_count):
-    """Test the function get_osio_user_count."""
+@mock.patch('src.utils.post_http_request')
+def test_get_osio_user_counts(_mock_post):
+    """Test osio user counts are fetched in one query and cached."""
+    _osio_user_count_cache.clear()
+    _mock_post.return_value = {'result': {'data': [3, 5]}}
+    epvs = [('maven', 'a', '1'), ('maven', 'b', '2'), ('maven', 'a', '1')]
+    assert get_osio_user_counts(epvs) == {('maven', 'a', '1'): 3, ('maven', 'b', '2'): 5}
+    _mock_post.assert_called_once()
+    bindings = _mock_post.call_args[1]['payload']['bindings']
+    assert bindings['epvs'] == [{'ecosystem': 'maven', 'name': 'a', 'version': '1'},
+                                {'ecosystem': 'maven', 'name': 'b', 'version': '2'}]
+
+    # served from cache, only the new epv is queried
+    _mock_post.return_value = {'result': {'data': [7]}}
+    counts = get_osio_user_counts([('maven', 'a', '1'), ('maven', 'c', '3')])
+    assert counts == {('maven', 'a', '1'): 3, ('maven', 'c', '3'): 7}
+    assert _mock_post.call_count == 2
+    assert _mock_post.call_args[1]['payload']['bindings']['epvs'] == [
+        {'ecosystem': 'maven', 'name': 'c', 'version': '3'}]
+
+    # failures are not cached
+    _mock_post.return_value = None
+    assert get_osio_user_counts([('maven', 'd', '4')]) == {('maven', 'd', '4'): -1}
+    assert ('maven', 'd', '4') not in _osio_user_count_cache._entries
+    _osio_user_count_cache.clear()
+
+
+@mock.patch('src.utils.get_osio_user_counts')
+def test_create_package_dict(_mock_counts):
+    """Test the function create_package_dict."""
+    _mock_counts.side_effect = lambda epvs: {epv: 1 for epv in epvs}
     with open('tests/data/companion_pkg_graph.json', 'r') as f:
         resp = json.loads(f.read())
     out = create_package_dict(resp)
     assert len(out) > 1
+    _mock_counts.assert_called_once()
+    assert all(pkg['osio_user_count'] == 1 for pkg in out)
+
+
+def test_index_insights_packages():
+    """Test insights entries are indexed by package name, later ones win."""
+    first = {'package_name': 'a', 'topic_list': ['x']}
+    second = {'package_name': 'a', 'topic_list': ['y']}
+    other = {'package_name': 'b'}
+    assert index_insights_packages([first, other, second]) == {'a': second, 'b': other}
+    assert index_insights_packages({'c': [first], 'd': [other, second]}) == {
+        'a': second, 'b': other}
+
+
+@mock.patch('src.utils.get_osio_user_counts')
+def test_create_package_dict_with_pgm_index(_mock_counts):
+    """Test companion topics are taken from the insights index."""
+    _mock_counts.side_effect = lambda epvs: {epv: 1 for epv in epvs}
+    with open('tests/data/companion_pkg_graph.json', 'r') as f:
+        resp = json.loads(f.read())
+    name = resp[0]['version']['pname'][0]
+    pgm_index = index_insights_packages([{'package_name': name, 'topic_list': ['web'],
+                                          'cooccurrence_probability': 42,
+                                          'cooccurrence_count': 7}])
+    out = create_package_dict(resp, pgm_index=pgm_index)
+    pkg = next(pkg for pkg in out if pkg['name'] == name)
+    assert pkg['topic_list'] == ['web']
+    assert pkg['cooccurrence_probability'] == 42
+    assert pkg['cooccurrence_count'] == 7
+    assert 'pgm_topics' not in resp[0]['package']
+
+
+def test_lazy_json():
+    """Test JSON is rendered on demand and capped."""
+    assert str(LazyJSON(['a', 'b'])) == '["a", "b"]'
+    assert str(LazyJSON(['a' * 20], max_chars=5)) == '["aaa... (24 chars)'
+    with mock.patch('src.utils.json.dumps') as _mock_dumps:
+        LazyJSON({'a': 1})
+        _mock_dumps.assert_not_called()
 
 
 def test_is_quickstart_majority():
@@ -0,0 +1,69 @@
+"""Tests for the version_index module."""
+
+import os
+from unittest import mock
+
+from src import stack_aggregator
+from src.version_index import VersionIndex, get_version_indexes, _version_indexes
+
+
+def _index():
+    return VersionIndex([('1.10', False), ('1.2', True), ('1.9', True), ('2.0', True),
+                         ('1.2', False), ('1.5', False), ('1.5.0', True), ('[1.4)', False)])
+
+
+def test_version_index():
+    """Test versions are sorted by parsed form and looked up by bisection."""
+    index = _index()
+    assert index.versions == ['1.2', '1.5', '1.9', '1.10', '2.0']
+    assert len(index) == 5
+    assert index.has_cve('1.2') is True
+    assert index.has_cve('1.5.0') is False
+    assert index.has_cve('1.3') is None
+    assert index.latest_non_cve_version() == '1.10'
+    assert index.recommended_version('1.0') == '1.10'
+    assert index.recommended_version('1.10.0') is None
+    assert index.recommended_version('3.0') is None
+    assert index.lowest_fixed_version('1.0') == '1.5'
+    assert index.lowest_fixed_version('1.5') == '1.10'
+    assert index.lowest_fixed_version('1.10') is None
+
+
+def test_version_index_empty():
+    """Test lookups of an index without safe versions."""
+    for index in (VersionIndex([]), VersionIndex([('1.0', True)])):
+        assert index.latest_non_cve_version() is None
+        assert index.recommended_version('0.1') is None
+        assert index.lowest_fixed_version('0.1') is None
+
+
+@mock.patch('src.version_index.post_gremlin')
+def test_get_version_indexes(_mock_gremlin):
+    """Test indexes are loaded once in batches and unknown packages get an empty one."""
+    _mock_gremlin.return_value = {'result': {'data': [{'six': [
+        {'version': '1.0', 'cve': True}, {'version': '1.1', 'cve': False}]}]}}
+    _version_indexes.clear()
+    indexes = get_version_indexes('pypi', ['six', 'foo', 'six'], 'has_snyk_cve')
+    assert indexes['six'].versions == ['1.0', '1.1']
+    assert len(indexes['foo']) == 0
+    assert _mock_gremlin.call_count == 1
+    bindings = _mock_gremlin.call_args[0][1]
+    assert bindings == {'eco': 'pypi', 'names': ['foo', 'six'], 'cve_edge': 'has_snyk_cve'}
+    assert get_version_indexes('pypi', ['six'], 'has_snyk_cve')['six'] is indexes['six']
+    assert _mock_gremlin.call_count == 1
+    get_version_indexes('pypi', ['six'], 'has_cve')
+    assert _mock_gremlin.call_count == 2
+
+
+@mock.patch('src.stack_aggregator.post_http_request')
+@mock.patch('src.version_index.post_gremlin')
+def test_get_recommended_version_from_index(_mock_gremlin, _mock_post):
+    """Test v1 recommended version is answered from the index when enabled."""
+    _mock_gremlin.return_value = {'result': {'data': [{'pkg': [
+        {'version': '2.1.5', 'cve': False}, {'version': '2.2.0', 'cve': True}]}]}}
+    _version_indexes.clear()
+    with mock.patch.dict(os.environ, {'VERSION_INDEX_ENABLED': 'true'}):
+        assert stack_aggregator.get_recommended_version('maven', 'pkg', '2.0.0') == '2.1.5'
+        assert stack_aggregator.get_recommended_version('maven', 'pkg', '2.2.0') is None
+    assert _mock_gremlin.call_count == 1
+    _mock_post.assert_not_called()
@@ -0,0 +1,60 @@
+"""Fixtures and data shared by the v2 unit tests."""
+
+import pytest
+
+from src.v2 import stack_aggregator as sa
+from src.v2.models import Package
+from src.v2.normalized_packages import NormalizedPackages
+
+
+@pytest.fixture(autouse=True)
+def _clear_epv_cache():
+    """Start every test with empty epv caches."""
+    sa._epv_cache.clear()
+    sa._unknown_epv_cache.clear()
+
+
+_DJANGO = Package(name='django', version='1.2.1')
+_FLASK = Package(name='flask', version='0.12')
+_SIX = Package(name='six', version='3.2.1')
+
+
+def _request_body():
+    return {
+        "manifest_file": "requirements.txt",
+        "manifest_file_path": "/foo/bar",
+        "external_request_id": "test_id",
+        "ecosystem": "pypi",
+        "packages": [
+            {
+                "name": "flask",
+                "version": "0.12",
+                "dependencies": [
+                    {'name': 'django', 'version': '1.2.1'}
+                ]
+            }, {
+                "name": "django",
+                "version": "1.2.1"
+            }
+         ]
+    }
+
+
+def _get_normalized_packages():
+    six = Package(name='six', version='1.2')
+    pip = Package(name='pip', version='20.1')
+    flask = Package(**{
+        'name': 'flask',
+        'version': '0.12',
+        'dependencies': [
+            {
+                'name': 'flask-mock',
+                'version': '0.0.13'
+            }]
+    })
+    bar = Package(**{
+        'name': 'bar',
+        'version': '0.12',
+        'dependencies': [flask, six, pip]
+    })
+    return NormalizedPackages([flask, bar], 'pypi')
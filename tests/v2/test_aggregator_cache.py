@@ -0,0 +1,102 @@
+"""Tests for the graph record caches of the v2 stack aggregator."""
+
+import json
+import threading
+import time
+from unittest import mock
+
+from src.v2 import stack_aggregator as sa
+from src.v2.stack_aggregator import StackAggregator
+from src.v2.models import StackAggregatorResultForFreeTier
+from src.v2.normalized_packages import NormalizedPackages
+from tests.v2.conftest import _request_body, _DJANGO, _FLASK, _SIX
+
+
+@mock.patch('src.v2.stack_aggregator.post_gremlin')
+@mock.patch('src.v2.stack_aggregator.get_license_analysis_for_stack')
+def test_epv_cache(_mock_license, _mock_gremlin):
+    """Test cached packages are not fetched again from graph."""
+    with open("tests/v2/data/graph_response_2_public_vuln.json", "r") as fin:
+        _mock_gremlin.return_value = json.load(fin)
+
+    StackAggregator().execute(_request_body(), persist=False)
+    _mock_gremlin.assert_called_once()
+    assert _mock_gremlin.call_args[0][1]['packages']
+
+    # django and flask are served from cache, only six goes to graph
+    payload = _request_body()
+    payload['packages'].append(_SIX.dict())
+    _mock_gremlin.reset_mock()
+    _mock_gremlin.return_value = {'result': {'data': []}}
+    resp = StackAggregator().execute(payload, persist=False)
+    _mock_gremlin.assert_called_once()
+    assert _mock_gremlin.call_args[0][1]['packages'] == [_SIX.dict(exclude={'dependencies'})]
+    result = StackAggregatorResultForFreeTier(**resp['result'])
+    assert len(result.analyzed_dependencies) == 2
+    assert _SIX in result.unknown_dependencies
+    assert sa.get_epv_lookup_stats()['epv_cache']['hits'] == 2
+
+
+@mock.patch('src.v2.stack_aggregator.server_create_analysis')
+@mock.patch('src.v2.stack_aggregator.post_gremlin')
+@mock.patch('src.v2.stack_aggregator.get_license_analysis_for_stack')
+def test_unknown_epv_cache(_mock_license, _mock_gremlin, _mock_unknown):
+    """Test packages missing in graph are not queried again."""
+    with open("tests/v2/data/graph_response_2_public_vuln.json", "r") as fin:
+        _mock_gremlin.return_value = json.load(fin)
+
+    payload = _request_body()
+    payload['packages'].append(_SIX.dict())
+    StackAggregator().execute(payload, persist=False)
+    _mock_gremlin.assert_called_once()
+    assert sa._unknown_epv_cache.get(('pypi', _SIX.name, _SIX.version))
+
+    # second request is served without any graph call, six is still unknown
+    _mock_gremlin.reset_mock()
+    resp = StackAggregator().execute(payload, persist=False)
+    _mock_gremlin.assert_not_called()
+    result = StackAggregatorResultForFreeTier(**resp['result'])
+    assert len(result.analyzed_dependencies) == 2
+    assert result.unknown_dependencies == [_SIX]
+
+    # once the entry expires six is looked up in graph again
+    sa._unknown_epv_cache.pop(('pypi', _SIX.name, _SIX.version))
+    StackAggregator().execute(payload, persist=False)
+    _mock_gremlin.assert_called_once()
+    assert _mock_gremlin.call_args[0][1]['packages'] == [_SIX.dict(exclude={'dependencies'})]
+
+
+@mock.patch('src.v2.stack_aggregator.post_gremlin')
+def test_concurrent_epv_lookups_are_coalesced(_mock_gremlin):
+    """Test EPVs in flight for one request are not fetched again by another."""
+    with open("tests/v2/data/graph_response_2_public_vuln.json", "r") as fin:
+        response = json.load(fin)
+    started = threading.Event()
+    release = threading.Event()
+
+    def slow_gremlin(*_args, **_kwargs):
+        started.set()
+        release.wait(5)
+        return response
+
+    _mock_gremlin.side_effect = slow_gremlin
+    packages = NormalizedPackages([_DJANGO, _FLASK], 'pypi')
+    results = {}
+
+    def lookup(name):
+        results[name] = sa.Freetier(normalized_packages=packages).get_package_details_from_graph()
+
+    leader = threading.Thread(target=lookup, args=('leader',))
+    leader.start()
+    assert started.wait(5)
+    follower = threading.Thread(target=lookup, args=('follower',))
+    follower.start()
+    while sa._epv_flights.stats()['coalesced'] < 2:
+        time.sleep(0.01)
+    release.set()
+    leader.join(5)
+    follower.join(5)
+
+    _mock_gremlin.assert_called_once()
+    assert results['leader'].keys() == results['follower'].keys() == {_DJANGO, _FLASK}
+    assert sa.get_epv_lookup_stats()['epv_flights']['in_flight'] == 0
@@ -0,0 +1,153 @@
+"""Tests for the epv_snapshot module."""
+
+import json
+import time
+from unittest import mock
+
+import pytest
+
+from src.v2 import epv_snapshot
+from src.v2.epv_snapshot import EPVSnapshot, EPVSnapshotError, write_snapshot
+from src.v2.stack_aggregator import StackAggregator, _FREE_TIER_VULNERABILITY_PROPERTIES
+from tests.v2.conftest import _request_body
+
+_RESPONSE = 'tests/v2/data/graph_response_2_public_vuln.json'
+
+
+@pytest.fixture(autouse=True)
+def _recheck_snapshot():
+    """Check the configured snapshot file on the first lookup of, and after, every test."""
+    epv_snapshot._snapshot['checked_at'] = None
+    yield
+    epv_snapshot._snapshot['checked_at'] = None
+
+
+def _records():
+    with open(_RESPONSE) as fin:
+        return json.load(fin)['result']['data']
+
+
+def _free_tier_records():
+    return [dict(record, vuln=[{prop: vuln[prop] for prop in _FREE_TIER_VULNERABILITY_PROPERTIES
+                                if prop in vuln} for vuln in record['vuln']])
+            for record in _records()]
+
+
+def test_write_and_get(tmp_path):
+    """Test records are found by EPV and the first of duplicates is kept."""
+    path = str(tmp_path / 'epv.snap')
+    django, flask = _records()
+    assert write_snapshot(path, [flask, django, dict(flask, vuln=[])], 'registered') == 2
+    snapshot = EPVSnapshot(path)
+    assert len(snapshot) == 2
+    assert snapshot.projection == 'registered'
+    assert snapshot.get('pypi', 'django', '1.2.1') == django
+    assert snapshot.get('pypi', 'flask', '0.12') == flask
+    assert snapshot.get('pypi', 'flask', '0.1') is None
+    assert snapshot.get('maven', 'django', '1.2.1') is None
+    assert write_snapshot(path, [], 'freetier') == 0
+    assert EPVSnapshot(path).get('pypi', 'django', '1.2.1') is None
+    assert EPVSnapshot(path).projection == 'freetier'
+    with pytest.raises(ValueError):
+        write_snapshot(path, [], 'premium')
+
+
+def test_invalid_snapshot(tmp_path):
+    """Test files which are not snapshots are rejected."""
+    path = tmp_path / 'epv.snap'
+    path.write_bytes(b'EPVSNAP')
+    with pytest.raises(EPVSnapshotError):
+        EPVSnapshot(str(path))
+    path.write_bytes(b'NOTASNAP' + bytes(20))
+    with pytest.raises(EPVSnapshotError):
+        EPVSnapshot(str(path))
+
+
+@mock.patch('src.v2.epv_snapshot.post_gremlin')
+def test_main(_mock_gremlin, tmp_path):
+    """Test snapshots are built from recorded responses and from graph."""
+    path = str(tmp_path / 'epv.snap')
+    with pytest.raises(SystemExit):
+        epv_snapshot.main([path, '--responses', _RESPONSE])
+    epv_snapshot.main([path, '--projection', 'freetier', '--responses', _RESPONSE, _RESPONSE])
+    assert len(EPVSnapshot(path)) == 2
+    assert EPVSnapshot(path).projection == 'freetier'
+
+    names = {'result': {'data': ['django']}}
+    keys = {'result': {'data': [{'name': 'django', 'version': '1.2.1'}]}}
+    details = {'result': {'data': _records()[:1]}}
+    _mock_gremlin.side_effect = [names, keys, details, {'result': {'data': []}}]
+    epv_snapshot.main([path, '--ecosystem', 'pypi'])
+    assert EPVSnapshot(path).get('pypi', 'django', '1.2.1') == _records()[0]
+    assert EPVSnapshot(path).projection == 'registered'
+    bindings = [call[0][1] for call in _mock_gremlin.call_args_list]
+    assert bindings[0] == {'ecosystem': 'pypi', 'after': '', 'page_size': 1000}
+    assert bindings[1] == {'ecosystem': 'pypi', 'names': ['django']}
+    assert bindings[2]['packages'] == keys['result']['data']
+    # the next page starts after the last package name of the previous one
+    assert bindings[3]['after'] == 'django'
+
+
+@mock.patch('src.v2.stack_aggregator.post_gremlin')
+@mock.patch('src.v2.stack_aggregator.get_license_analysis_for_stack')
+def test_aggregator_reads_snapshot(_mock_license, _mock_gremlin, tmp_path, monkeypatch):
+    """Test EPVs found in the snapshot are not queried from graph."""
+    path = str(tmp_path / 'epv.snap')
+    write_snapshot(path, _records(), 'registered')
+    monkeypatch.setenv('EPV_SNAPSHOT_PATH', path)
+    resp = StackAggregator().execute(_request_body(), persist=False)
+    assert resp['aggregation'] == 'success'
+    assert len(resp['result']['analyzed_dependencies']) == 2
+    _mock_gremlin.assert_not_called()
+    assert epv_snapshot.get_epv_snapshot() is epv_snapshot.get_epv_snapshot()
+    monkeypatch.setenv('EPV_SNAPSHOT_PATH', str(tmp_path / 'missing.snap'))
+    epv_snapshot._snapshot['checked_at'] = None
+    assert epv_snapshot.get_epv_snapshot() is None
+
+
+@mock.patch('src.v2.stack_aggregator.post_gremlin')
+@mock.patch('src.v2.stack_aggregator.get_license_analysis_for_stack')
+def test_free_tier_snapshot_is_not_used_for_registered(_mock_license, _mock_gremlin,
+                                                       tmp_path, monkeypatch):
+    """Test registered requests go to graph when the snapshot holds free tier records."""
+    path = str(tmp_path / 'epv.snap')
+    write_snapshot(path, _free_tier_records(), 'freetier')
+    monkeypatch.setenv('EPV_SNAPSHOT_PATH', path)
+    with open(_RESPONSE) as fin:
+        _mock_gremlin.return_value = json.load(fin)
+    payload = _request_body()
+    payload['registration_status'] = 'registered'
+    resp = StackAggregator().execute(payload, persist=False)
+    assert resp['aggregation'] == 'success'
+    _mock_gremlin.assert_called_once()
+    vulnerabilities = [vuln for dep in resp['result']['analyzed_dependencies']
+                       for vuln in dep['public_vulnerabilities']]
+    assert vulnerabilities and all(vuln['description'] for vuln in vulnerabilities)
+
+    # free tier requests are served from it
+    _mock_gremlin.reset_mock()
+    resp = StackAggregator().execute(_request_body(), persist=False)
+    assert resp['aggregation'] == 'success'
+    _mock_gremlin.assert_not_called()
+
+
+def test_snapshot_age_and_check_interval(tmp_path, monkeypatch):
+    """Test stale snapshots are not used and the file is only checked every interval."""
+    path = str(tmp_path / 'epv.snap')
+    built_at = int(time.time()) - 100
+    write_snapshot(path, _records(), 'registered', built_at=built_at)
+    assert EPVSnapshot(path).built_at == built_at
+    monkeypatch.setenv('EPV_SNAPSHOT_PATH', path)
+    monkeypatch.setenv('EPV_SNAPSHOT_MAX_AGE', '10')
+    assert epv_snapshot.get_epv_snapshot() is None
+
+    monkeypatch.setenv('EPV_SNAPSHOT_MAX_AGE', '1000')
+    monkeypatch.setenv('EPV_SNAPSHOT_CHECK_INTERVAL', '3600')
+    epv_snapshot._snapshot['checked_at'] = None
+    snapshot = epv_snapshot.get_epv_snapshot()
+    assert snapshot is not None
+    with mock.patch('src.v2.epv_snapshot.Settings') as _mock_settings, \
+            mock.patch('os.stat') as _mock_stat:
+        assert epv_snapshot.get_epv_snapshot() is snapshot
+    _mock_settings.assert_not_called()
+    _mock_stat.assert_not_called()
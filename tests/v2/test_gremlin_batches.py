@@ -0,0 +1,108 @@
+"""Tests for the concurrent gremlin batches of the v2 stack aggregator."""
+
+import os
+import requests
+import time
+from unittest import mock
+
+import pytest
+
+from src.v2 import stack_aggregator as sa
+from src.utils import GremlinExeception
+from src.batch_sizer import get_batch_sizer
+from tests.v2.conftest import _get_normalized_packages
+
+
+def _batch_response(query, bindings):
+    """Echo back one record per package, slowing down the first batch."""
+    if bindings['packages'][0]['name'] == 'bar':
+        time.sleep(0.1)
+    return {'result': {'data': [pkg['name'] for pkg in bindings['packages']]}}
+
+
+@mock.patch('src.v2.stack_aggregator.GREMLIN_QUERY_SIZE', 1)
+@mock.patch('src.v2.stack_aggregator.post_gremlin', side_effect=_batch_response)
+def test_gremlin_batch_concurrent_merge_order(_mock_gremlin):
+    """Test batches are merged in submission order regardless of completion order."""
+    packages = _get_normalized_packages()
+    aggregator = sa.Freetier(normalized_packages=packages)
+    result = list(aggregator._get_package_details_from_graph(packages.all_dependencies))
+    assert _mock_gremlin.call_count == 5
+    assert result == [pkg.name for pkg in packages.all_dependencies]
+
+
+@mock.patch('src.v2.stack_aggregator.GREMLIN_QUERY_SIZE', 1)
+@mock.patch('src.v2.stack_aggregator.post_gremlin', side_effect=_batch_response)
+def test_gremlin_batches_are_submitted_lazily(_mock_gremlin):
+    """Test no more batches than the per request concurrency are submitted ahead."""
+    packages = _get_normalized_packages()
+    aggregator = sa.Freetier(normalized_packages=packages)
+    with mock.patch.dict(os.environ, {'GREMLIN_BATCH_CONCURRENCY_PER_REQUEST': '2'}):
+        records = aggregator._get_package_details_from_graph(packages.all_dependencies)
+        assert next(records) == packages.all_dependencies[0].name
+        assert _mock_gremlin.call_count <= 2
+        assert list(records) == [pkg.name for pkg in packages.all_dependencies[1:]]
+    assert _mock_gremlin.call_count == 5
+
+
+@mock.patch('src.v2.stack_aggregator.GREMLIN_QUERY_SIZE', 2)
+@mock.patch('src.v2.stack_aggregator.post_gremlin')
+def test_gremlin_batch_failure_is_reported(_mock_gremlin):
+    """Test a failed batch fails the lookup instead of being dropped."""
+    _mock_gremlin.side_effect = [{'result': {'data': []}},
+                                 GremlinExeception('mocked'),
+                                 {'result': {'data': []}}]
+    packages = _get_normalized_packages()
+    with mock.patch.dict(os.environ, {'GREMLIN_BATCH_CONCURRENCY_PER_REQUEST': '1'}), \
+            pytest.raises(GremlinExeception, match='1 of 3'):
+        sa.Freetier(normalized_packages=packages).get_package_details_from_graph()
+    # remaining batches are still executed
+    assert _mock_gremlin.call_count == 3
+
+
+def _timeout_on_large_batch(query, bindings):
+    """Time out batches of more than one package."""
+    if len(bindings['packages']) > 1:
+        raise GremlinExeception from requests.exceptions.ReadTimeout()
+    return _batch_response(query, bindings)
+
+
+@mock.patch('src.v2.stack_aggregator.GREMLIN_QUERY_SIZE', 4)
+@mock.patch('src.v2.stack_aggregator.post_gremlin', side_effect=_timeout_on_large_batch)
+def test_gremlin_batch_timeout_is_split(_mock_gremlin):
+    """Test timed out batches are retried in halves and the batch size adapts."""
+    packages = _get_normalized_packages()
+    aggregator = sa.Freetier(normalized_packages=packages)
+    with mock.patch.dict(os.environ, {'GREMLIN_ADAPTIVE_BATCHING': 'true',
+                                      'GREMLIN_BATCH_MIN_SIZE': '1',
+                                      'GREMLIN_BATCH_CONCURRENCY_PER_REQUEST': '1'}), \
+            mock.patch.dict('src.batch_sizer._batch_sizers', clear=True):
+        result = list(aggregator._get_package_details_from_graph(packages.all_dependencies))
+        assert get_batch_sizer('epv_details', 'pypi', 4).size < 4
+    assert result == [pkg.name for pkg in packages.all_dependencies]
+    assert len(_mock_gremlin.call_args_list[0][0][1]['packages']) == 4
+
+
+@mock.patch('src.v2.stack_aggregator.GREMLIN_QUERY_SIZE', 2)
+@mock.patch('src.v2.stack_aggregator.post_gremlin')
+@mock.patch('src.v2.stack_aggregator.post_gremlin_stream')
+def test_gremlin_stream_responses(_mock_stream, _mock_gremlin):
+    """Test records of streamed batches are parsed as they are consumed."""
+    parsed = []
+
+    def stream(query, bindings):
+        for record in _batch_response(query, bindings)['result']['data']:
+            parsed.append(record)
+            yield record
+
+    _mock_stream.side_effect = stream
+    packages = _get_normalized_packages()
+    aggregator = sa.Freetier(normalized_packages=packages)
+    with mock.patch.dict(os.environ, {'GREMLIN_STREAM_RESPONSES': 'true'}):
+        records = aggregator._get_package_details_from_graph(packages.all_dependencies)
+        assert next(records) == packages.all_dependencies[0].name
+        # only the first record of every batch is read ahead
+        assert len(parsed) <= 3
+        assert list(records) == [pkg.name for pkg in packages.all_dependencies[1:]]
+    assert _mock_stream.call_count == 3
+    _mock_gremlin.assert_not_called()
@@ -1,7 +1,7 @@
 """Tests for the v2 normalized package module."""
 
 from src.v2.models import Package
-from src.v2.normalized_packages import NormalizedPackages
+from src.v2.normalized_packages import NormalizedPackages, PackageKey
 
 
 def test_normalized_packages_basic_direct():
@@ -143,3 +143,18 @@ def test_normalized_packages_dependency_graph():
     assert pip not in normalized.dependency_graph[foo]
     assert pip in normalized.dependency_graph[bar]
     assert six in normalized.dependency_graph[bar]
+
+
+def test_normalized_packages_keys_are_interned():
+    """Test every name and version is represented by one PackageKey."""
+    normalized = _get_normalized_packages()
+    keys = {}
+    for direct, transitives in normalized.dependency_graph.items():
+        for key in (direct, *transitives):
+            assert type(key) is PackageKey
+            assert keys.setdefault(key, key) is key
+    six = PackageKey('six', '1.2')
+    assert six == ('six', '1.2')
+    assert hash(six) == hash(Package(name='six', version='1.2'))
+    assert six.to_package() == Package(name='six', version='1.2')
+    assert six.to_package().dict() == {'name': 'six', 'version': '1.2', 'dependencies': None}
@@ -235,13 +235,20 @@ def test_get_version_information(_mock1):
     assert len(out) == 1
 
 
-def test_get_topics():
-    """Test the function get topics."""
-    comp_list = GraphDB.get_topics_for_comp(graph_resp['result']['data'],
-                                            insights_resp[0]['companion_packages'])
-
-    assert comp_list is not None
-    assert isinstance(comp_list, list)
+@mock.patch('src.v2.recommender.GREMLIN_QUERY_SIZE', 2)
+@mock.patch('src.v2.recommender.post_gremlin')
+def test_get_version_information_uses_bindings(_mock_gremlin):
+    """Test packages are looked up by a bound script, in batches."""
+    _mock_gremlin.side_effect = [{'result': {'data': [1, 2]}}, {'result': {'data': [3]}}]
+    names = ["a", "c'); g.V().drop(); ('", "b", "a"]
+    assert GraphDB().get_version_information(names, 'maven') == [1, 2, 3]
+    (first, first_bindings), (second, second_bindings) = [
+        call[0] for call in _mock_gremlin.call_args_list]
+    assert first == second
+    assert 'drop' not in first
+    assert "has('pname', name).has('version', within(lnv))" in first
+    assert first_bindings == {'eco': 'maven', 'names': ["a", "b"]}
+    assert second_bindings == {'eco': 'maven', 'names': ["c'); g.V().drop(); ('"]}
 
 
 @mock.patch('src.v2.recommender.extract_user_stack_package_licenses', return_value=[])
@@ -287,5 +294,4 @@ if __name__ == '__main__':
     test_get_version_information()
     test_apply_license_filter()
     test_perform_license_analysis()
-    test_get_topics()
     test_prepare_final_filtered_list()
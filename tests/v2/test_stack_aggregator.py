@@ -2,6 +2,8 @@
 
 import copy
 import json
+import os
+import pytest
 from unittest import mock
 from functools import partial
 
@@ -12,32 +14,7 @@ from src.v2.models import (Package, BasicVulnerabilityFields,
                            StackAggregatorResultForFreeTier,
                            StackAggregatorResultForRegisteredUser)
 from src.v2.normalized_packages import NormalizedPackages
-
-
-_DJANGO = Package(name='django', version='1.2.1')
-_FLASK = Package(name='flask', version='0.12')
-_SIX = Package(name='six', version='3.2.1')
-
-
-def _request_body():
-    return {
-        "manifest_file": "requirements.txt",
-        "manifest_file_path": "/foo/bar",
-        "external_request_id": "test_id",
-        "ecosystem": "pypi",
-        "packages": [
-            {
-                "name": "flask",
-                "version": "0.12",
-                "dependencies": [
-                    {'name': 'django', 'version': '1.2.1'}
-                ]
-            }, {
-                "name": "django",
-                "version": "1.2.1"
-            }
-         ]
-    }
+from tests.v2.conftest import _DJANGO, _FLASK, _SIX, _get_normalized_packages, _request_body
 
 
 @mock.patch('src.v2.stack_aggregator.post_gremlin')
@@ -168,6 +145,24 @@ def test_with_2_public_vuln_for_registered(_mock_license, _mock_gremlin):
                vulnerable_dependencies[0].public_vulnerabilities) == 2
 
 
+@mock.patch('src.v2.stack_aggregator.post_gremlin')
+def test_epv_details_query_projection(_mock_gremlin):
+    """Test only the properties needed by each tier are fetched."""
+    _mock_gremlin.return_value = None
+    packages = NormalizedPackages([_DJANGO], 'pypi')
+    sa.Freetier(normalized_packages=packages).get_package_details_from_graph()
+    sa._unknown_epv_cache.clear()
+    sa.Registered(normalized_packages=packages).get_package_details_from_graph()
+    free_tier_query = _mock_gremlin.call_args_list[0][0][0]
+    registered_query = _mock_gremlin.call_args_list[1][0][0]
+    for query in (free_tier_query, registered_query):
+        assert 'valueMap()' not in query
+        assert "'gh_stargazers'" in query
+        assert "'snyk_vuln_id'" in query
+    assert "'description'" not in free_tier_query
+    assert "'description'" in registered_query
+
+
 @mock.patch('src.v2.stack_aggregator.server_create_analysis')
 @mock.patch('src.v2.stack_aggregator.post_gremlin')
 @mock.patch('src.v2.stack_aggregator.get_license_analysis_for_stack')
@@ -218,6 +213,9 @@ def test_db_store(_mock_license, _mock_gremlin, _mock_store):
     assert resp['result'] is not None
     result = resp['result']
     assert result['external_request_id'] == 'test_id'
+    # stored and returned result share the same encoding
+    assert _mock_store.call_args[1]['task_result'] is result
+    assert json.loads(result.encoded)['external_request_id'] == 'test_id'
 
 
 def _recommended_version_fallback(body, *args, **kwargs):
@@ -267,7 +265,8 @@ def test_get_recommended_version_fallback_result_none(_mock_license, _mock_greml
 
 
 @mock.patch('src.v2.stack_aggregator.post_gremlin',
-            side_effect=partial(_recommended_version_fallback, {'result': {'data': ['10.1']}}))
+            side_effect=partial(_recommended_version_fallback,
+                                {'result': {'data': [{'django': ['10.1']}]}}))
 @mock.patch('src.v2.stack_aggregator.get_license_analysis_for_stack')
 def test_get_recommended_version_fallback_result_valid_latest(_mock_license, _mock_gremlin):
     """Test recommended_latest_version fallback call."""
@@ -285,7 +284,7 @@ def test_get_recommended_version_fallback_result_valid_latest(_mock_license, _mo
 
 @mock.patch('src.v2.stack_aggregator.post_gremlin',
             side_effect=partial(_recommended_version_fallback,
-                                {'result': {'data': ['10.1', '11.2']}}))
+                                {'result': {'data': [{'django': ['10.1', '11.2']}]}}))
 @mock.patch('src.v2.stack_aggregator.get_license_analysis_for_stack')
 def test_get_recommended_version_fallback_result_multiple_latest(_mock_license, _mock_gremlin):
     """Test recommended_latest_version fallback call."""
@@ -302,7 +301,8 @@ def test_get_recommended_version_fallback_result_multiple_latest(_mock_license,
 
 
 @mock.patch('src.v2.stack_aggregator.post_gremlin',
-            side_effect=partial(_recommended_version_fallback, {'result': {'data': ['1.2.1']}}))
+            side_effect=partial(_recommended_version_fallback,
+                                {'result': {'data': [{'django': ['1.2.1']}]}}))
 @mock.patch('src.v2.stack_aggregator.get_license_analysis_for_stack')
 def test_get_recommended_version_fallback_result_affected_as_latest(_mock_license, _mock_gremlin):
     """Test recommended_latest_version fallback call."""
@@ -318,6 +318,23 @@ def test_get_recommended_version_fallback_result_affected_as_latest(_mock_licens
     assert result.analyzed_dependencies[django_index].recommended_version is None
 
 
+@mock.patch('src.v2.stack_aggregator.post_gremlin')
+def test_get_recommended_versions_batched(_mock_gremlin):
+    """Test recommended versions of many packages are fetched in one call."""
+    _mock_gremlin.return_value = {'result': {'data': [{
+        'django': ['1.2.1', '2.2', '3.0.1'],
+        'six': ['3.2.1']
+    }]}}
+    django_new = Package(name='django', version='2.2')
+    pkgs = [_DJANGO, django_new, _SIX, _FLASK]
+    versions = sa.get_recommended_versions('pypi', pkgs)
+    _mock_gremlin.assert_called_once()
+    assert _mock_gremlin.call_args[0][1] == {'eco': 'pypi',
+                                             'names': ['django', 'flask', 'six']}
+    assert versions == {_DJANGO: '3.0.1', django_new: '3.0.1', _SIX: None, _FLASK: None}
+    assert sa.get_recommended_version('pypi', _SIX) is None
+
+
 # ref: https://stackoverflow.com/a/29525603/1942688
 # ref: https://docs.python.org/dev/library/unittest.mock-examples.html#coping-with-mutable-arguments
 class _ModifiedMagicMock(mock.MagicMock):
@@ -326,31 +343,15 @@ class _ModifiedMagicMock(mock.MagicMock):
                                                                 **copy.deepcopy(kwargs))
 
 
-def _get_normalized_packages():
-    six = Package(name='six', version='1.2')
-    pip = Package(name='pip', version='20.1')
-    flask = Package(**{
-        'name': 'flask',
-        'version': '0.12',
-        'dependencies': [
-            {
-                'name': 'flask-mock',
-                'version': '0.0.13'
-            }]
-    })
-    bar = Package(**{
-        'name': 'bar',
-        'version': '0.12',
-        'dependencies': [flask, six, pip]
-    })
-    return NormalizedPackages([flask, bar], 'pypi')
-
-
 def _gremlin_batch_test(_mock_gremlin, size: int):
     packages = _get_normalized_packages()
     _mock_gremlin.return_value = None
-    with mock.patch('src.v2.stack_aggregator.GREMLIN_QUERY_SIZE', size):
+    # dispatch one batch at a time to keep call order deterministic.
+    with mock.patch('src.v2.stack_aggregator.GREMLIN_QUERY_SIZE', size), \
+            mock.patch.dict(os.environ, {'GREMLIN_BATCH_CONCURRENCY_PER_REQUEST': '1'}):
         _mock_gremlin.reset_mock()
+        # packages missing in previous round would be skipped otherwise
+        sa._unknown_epv_cache.clear()
         sa.Freetier(normalized_packages=packages).get_package_details_from_graph()
         ith = 0
         last = 0
@@ -382,3 +383,68 @@ def test_gremlin_batch_call(_mock_gremlin):
     assert (2, 3, 2) == _gremlin_batch_test(_mock_gremlin, 3)
     assert (2, 4, 1) == _gremlin_batch_test(_mock_gremlin, 4)
     assert (1, 0, 5) == _gremlin_batch_test(_mock_gremlin, 5)
+
+
+@pytest.mark.parametrize('registration_status', ['freetier', 'registered'])
+@mock.patch('src.v2.stack_aggregator.post_gremlin')
+@mock.patch('src.v2.stack_aggregator.get_license_analysis_for_stack')
+def test_models_without_validation(_mock_license, _mock_gremlin, registration_status,
+                                   monkeypatch):
+    """Test models built without validation are the same as validated ones."""
+    with open("tests/v2/data/graph_response_2_public_vuln.json", "r") as fin:
+        _mock_gremlin.return_value = json.load(fin)
+    payload = _request_body()
+    payload['registration_status'] = registration_status
+    results = []
+    for validate in ('true', 'false'):
+        sa._epv_cache.clear()
+        monkeypatch.setenv('VALIDATE_GRAPH_MODELS', validate)
+        result = StackAggregator().execute(payload, persist=False)['result']
+        results.append({key: value for key, value in result.items() if key != '_audit'})
+    assert results[0] == results[1]
+    assert json.dumps(results[0], default=str) == json.dumps(results[1], default=str)
+    assert results[1]['analyzed_dependencies'][0]['github']['total_releases'] in (196, 32)
+
+
+@mock.patch('src.v2.stack_aggregator.post_gremlin')
+@mock.patch('src.v2.stack_aggregator.get_license_analysis_for_stack')
+def test_normalized_response(_mock_license, _mock_gremlin):
+    """Test vulnerable transitives are listed once in normalized responses."""
+    with open("tests/v2/data/graph_response_2_public_vuln.json", "r") as fin:
+        _mock_gremlin.return_value = json.load(fin)
+    payload = _request_body()
+    denormalized = StackAggregator().execute(payload, persist=False)['result']
+    payload['normalized_response'] = True
+    normalized = StackAggregator().execute(payload, persist=False)['result']
+
+    assert 'vulnerable_dependency_details' not in denormalized
+    assert b'vulnerable_dependency_details' not in denormalized.encoded
+    flask = next(dep for dep in denormalized['analyzed_dependencies'] if dep['name'] == 'flask')
+    assert [dep['name'] for dep in flask['vulnerable_dependencies']] == ['django']
+    assert normalized['vulnerable_dependency_details'] == flask['vulnerable_dependencies']
+    for dep in normalized['analyzed_dependencies']:
+        assert dep['vulnerable_dependencies'] is None
+        assert dep['dependencies'] == next(denormalized_dep['dependencies'] for denormalized_dep
+                                           in denormalized['analyzed_dependencies']
+                                           if denormalized_dep['name'] == dep['name'])
+
+
+@mock.patch('src.v2.stack_aggregator.post_gremlin')
+def test_denormalized_details_are_shared(_mock_gremlin):
+    """Test details of vulnerable transitives are shared, not copied per direct."""
+    with open("tests/v2/data/graph_response_2_public_vuln.json", "r") as fin:
+        _mock_gremlin.return_value = json.load(fin)
+    packages = NormalizedPackages([Package(name='flask', version='0.12', dependencies=[_DJANGO]),
+                                   Package(name='six', version='3.2.1', dependencies=[_DJANGO])],
+                                  'pypi')
+    aggregator = sa.Freetier(normalized_packages=packages)
+    aggregator.fetch_details()
+    details = aggregator._get_denormalized_package_details()
+    django_detail = aggregator._normalized_package_details[_DJANGO]
+    flask_detail = next(detail for detail in details if detail.name == 'flask')
+    assert flask_detail is not aggregator._normalized_package_details[_FLASK]
+    assert flask_detail.vulnerable_dependencies[0] is django_detail
+    assert aggregator._normalized_package_details[_FLASK].vulnerable_dependencies is None
+    details = aggregator._get_denormalized_package_details()
+    flask_detail = next(detail for detail in details if detail.name == 'flask')
+    assert flask_detail.vulnerable_dependencies[0] is django_detail
@@ -0,0 +1,67 @@
+"""Measure the per package cost of building v2 stack aggregator response models.
+
+Package details of a stack of synthetic packages, each having two public
+vulnerabilities, are built from graph records with and without validation
+of the response models.
+
+Usage:
+python3 tools/benchmark_package_details.py [packages] [rounds]
+"""
+
+import copy
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from src.v2 import stack_aggregator as sa  # noqa: E402
+from src.v2.models import Package  # noqa: E402
+from src.v2.normalized_packages import NormalizedPackages  # noqa: E402
+
+_GRAPH_RESPONSE = os.path.join(os.path.dirname(__file__), '..', 'tests', 'v2', 'data',
+                               'graph_response_2_public_vuln.json')
+
+
+def get_records(count):
+    """Create graph records of count distinct packages."""
+    with open(_GRAPH_RESPONSE) as fin:
+        template = json.load(fin)['result']['data'][0]
+    records = []
+    for i in range(count):
+        record = copy.deepcopy(template)
+        record['version']['pname'] = ['package-{}'.format(i)]
+        records.append(record)
+    return records
+
+
+def measure(aggregator_cls, records, validate, rounds):
+    """Return best per package time, in microseconds, of building the package details."""
+    os.environ['VALIDATE_GRAPH_MODELS'] = 'true' if validate else 'false'
+    packages = NormalizedPackages([Package(name=record['version']['pname'][0],
+                                           version=record['version']['version'][0])
+                                   for record in records], 'pypi')
+    aggregator = aggregator_cls(normalized_packages=packages)
+
+    def build():
+        details = dict(aggregator._get_package_details(record) for record in records)
+        return [detail.dict() for detail in details.values()]
+
+    best = min(timeit.repeat(build, number=1, repeat=rounds))
+    return best / len(records) * 1e6
+
+
+def main(count=1000, rounds=5):
+    """Print per package cost of every aggregator with and without validation."""
+    records = get_records(count)
+    for aggregator_cls in (sa.Freetier, sa.Registered):
+        validated = measure(aggregator_cls, records, True, rounds)
+        trusted = measure(aggregator_cls, records, False, rounds)
+        print('{:<10} {} packages: validated {:8.1f} us/package, '
+              'trusted {:8.1f} us/package ({:.1f}x)'.format(
+                  aggregator_cls.__name__, count, validated, trusted, validated / trusted))
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:]))